@@ -0,0 +1,254 @@
+# 汽车销售系统压力测试：在本进程中以临时端口启动服务器，按给定比例并发请求各个路径，
+# 输出每个并发级别下各路径的吞吐量与延迟分位数（JSON）
+import argparse
+import http.client
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import car_sales_system as app
+
+# 可测试的路径：名称 -> (方法, 地址)，POST 请求的正文在发送时生成
+ROUTES = {
+    'inventory_page': ('GET', '/inventory_management.html'),
+    'vehicles_page': ('GET', '/vehicles_management.html'),
+    'api_inventory': ('GET', '/api/inventory'),
+    'api_transactions': ('GET', '/api/transactions?size=50'),
+    'api_options': ('GET', '/api/options'),
+    'api_suggest': ('GET', '/api/suggest?field=brand&prefix=' + quote(app.SEED_BRANDS[0][0])),
+    'static_css': ('GET', '/car_sales_system.css'),
+    'metrics': ('GET', '/metrics'),
+    'api_reports': ('GET', '/api/reports?start=2024-01-01&end=2024-06-30&granularity=month&group=brand'),
+    'export': ('GET', '/export/financials?format=csv&start=2024-12-01&end=2024-12-31'),
+    'login': ('POST', '/login'),
+    'buy': ('POST', '/add_message'),
+    'sell': ('POST', '/add_message'),
+    'batch': ('POST', '/add_messages'),
+}
+
+# 批量写入请求中的记录数，买入与卖出各占一半
+BATCH_SIZE = 20
+
+DEFAULT_MIX = 'inventory_page=2,vehicles_page=2,api_inventory=2,api_transactions=2,api_suggest=1,static_css=1,sell=2,buy=1'
+
+# 解析请求比例，例如 "inventory_page=2,sell=1"
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f'未知的路径：{name}，可选 {", ".join(ROUTES)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+# 数据库中的车辆：(品牌, 型号, 厂商)
+def load_vehicles():
+    conn, cursor = app.connect_to_database()
+    try:
+        return cursor.execute('SELECT brand, model, manufacturers.name FROM vehicles JOIN manufacturers ON manufacturers.id = vehicles.manufacturer_id').fetchall()
+    finally:
+        conn.close()
+
+# 把每种车辆的库存补足到 target，避免测试中的卖出因库存不足而失败。只买入差额，
+# 反复使用同一个 --database 时库存不会越来越多，统计与库存页面的数据保持接近真实规模
+def stock_up(target):
+    conn, cursor = app.connect_to_database()
+    try:
+        rows = cursor.execute('''
+            SELECT brand, model, manufacturers.name, COALESCE(inventory.quantity, 0) FROM vehicles
+            JOIN manufacturers ON manufacturers.id = vehicles.manufacturer_id
+            LEFT JOIN inventory ON inventory.vehicle_id = vehicles.id
+        ''').fetchall()
+    finally:
+        conn.close()
+    records = [(brand, model, manufacturer, 'buy', target - quantity, '供应商') for brand, model, manufacturer, quantity in rows if quantity < target]
+    for start in range(0, len(records), app.MAX_BATCH_RECORDS):
+        app.write_queue.submit(app.write_records, records[start:start + app.MAX_BATCH_RECORDS], True)
+
+# 不输出访问日志的请求处理器
+class QuietHandler(app.car_sales_system):
+    def log_message(self, format, *args):
+        pass
+
+# 登录并返回会话 Cookie
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        conn.request('POST', '/login', json.dumps({'username': 'guest', 'password': 'guest'}), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f'登录失败：{response.status}')
+        return response.getheader('Set-Cookie').split(';')[0]
+    finally:
+        conn.close()
+
+# 生成 POST 请求的正文
+def request_body(name, rng, vehicles, customers):
+    if name == 'login':
+        return {'username': 'guest', 'password': 'guest'}
+    if name == 'batch':
+        return {'records': [request_body(('buy', 'sell')[i % 2], rng, vehicles, customers) for i in range(BATCH_SIZE)]}
+    brand, model, manufacturer = rng.choice(vehicles)
+    return {'brand': brand, 'model': model, 'manufacturer': manufacturer, 'operation': name, 'quantity': 1, 'customername': f'客户{rng.randrange(customers)}'}
+
+# 并发请求的工作线程，逐个记录 (路径, 延迟, 是否出错)
+def run_worker(port, cookie, mix, vehicles, customers, seed, deadline, samples):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = list(mix.values())
+    headers = {'Cookie': cookie, 'Accept-Encoding': 'gzip'}
+    # 服务器保持连接时复用同一连接，否则 http.client 在下一个请求前自动重新连接
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        method, path = ROUTES[name]
+        body = None
+        if method == 'POST':
+            body = json.dumps(request_body(name, rng, vehicles, customers))
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, dict(headers, **({'Content-Type': 'application/json'} if body else {})))
+            response = conn.getresponse()
+            response.read()
+            failed = response.status >= 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            failed = True
+        samples.append((name, time.perf_counter() - start, failed))
+    conn.close()
+
+# 延迟统计，单位为毫秒
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    summary = {'requests': len(latencies), 'errors': errors, 'throughput': round(len(latencies) / elapsed, 2)}
+    if latencies:
+        # 最近秩法求分位数
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, max(0, int(p / 100 * len(latencies) + 0.5) - 1))] * 1000, 3)
+        summary['latency_ms'] = {
+            'min': round(latencies[0] * 1000, 3),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': round(latencies[-1] * 1000, 3),
+        }
+    return summary
+
+# 以给定并发数运行一段时间，返回该级别的统计结果
+def run_level(port, cookie, mix, vehicles, customers, seed, concurrency, duration):
+    samples = []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=run_worker, args=(port, cookie, mix, vehicles, customers, seed + i, deadline, samples)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    level = dict(concurrency=concurrency, duration=round(elapsed, 3), **summarize([s[1] for s in samples], sum(s[2] for s in samples), elapsed))
+    level['routes'] = {}
+    for name in mix:
+        route_samples = [s for s in samples if s[0] == name]
+        level['routes'][name] = summarize([s[1] for s in route_samples], sum(s[2] for s in route_samples), elapsed)
+    return level
+
+def main():
+    parser = argparse.ArgumentParser(description='汽车销售系统压力测试')
+    parser.add_argument('--database', help='数据库文件路径，默认在临时目录中新建；文件已存在时直接使用，不写入测试数据')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='服务器前端')
+    parser.add_argument('--mode', choices=['single', 'threaded', 'pool'], default='pool', help='服务器的请求处理模式')
+    parser.add_argument('--workers', type=int, default=8, help='线程池模式下的工作线程数')
+    parser.add_argument('--backlog', type=int, default=64, help='监听队列长度')
+    parser.add_argument('--pool-size', type=int, default=0, help='数据库连接池上限，默认为工作线程数加一')
+    parser.add_argument('--commit-window', type=float, default=2, help='合并提交的等待时间，单位为毫秒')
+    parser.add_argument('--concurrency', default='1,4,16', help='逗号分隔的并发数，每个并发数运行一轮')
+    parser.add_argument('--duration', type=float, default=5, help='每轮的运行时间，单位为秒')
+    parser.add_argument('--warmup', type=float, default=1, help='正式测试前的预热时间，单位为秒')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'各路径的请求比例，默认 {DEFAULT_MIX}')
+    parser.add_argument('--manufacturers', type=int, default=20, help='测试数据中的厂商数')
+    parser.add_argument('--models', type=int, default=200, help='测试数据中的车辆型号数')
+    parser.add_argument('--customers', type=int, default=5000, help='测试数据中的客户数')
+    parser.add_argument('--transactions', type=int, default=100000, help='测试数据中的交易数')
+    parser.add_argument('--stock', type=int, default=200, help='每轮开始前把每种车辆的库存补足到的数量，卖出因库存不足失败时调高')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    parser.add_argument('--output', default='-', help='报告文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    temp_dir = None
+    database = args.database
+    if database is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        database = os.path.join(temp_dir.name, 'car_sales.db')
+    seeded = not os.path.exists(database)
+    app.use_database(database)
+    app.write_queue.window = args.commit_window / 1000
+    app.database_pool.size = args.pool_size or max(args.workers, 1) + 1
+    if seeded:
+        app.seed_database(args.manufacturers, args.models, args.customers, args.transactions, seed=args.seed)
+    else:
+        app.prepare_database()
+    vehicles = load_vehicles()
+    app.identity_cache.warm()
+
+    httpd = app.create_server(('127.0.0.1', 0), QuietHandler, args.mode, args.workers, args.backlog, args.engine)
+    port = httpd.server_address[1]
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        cookie = login(port)
+        if args.warmup > 0:
+            stock_up(args.stock)
+            run_level(port, cookie, args.mix, vehicles, args.customers, args.seed, 1, args.warmup)
+        levels = []
+        for concurrency in [int(n) for n in args.concurrency.split(',')]:
+            # 每轮开始前补足库存，补货的写入不计入该轮
+            stock_up(args.stock)
+            level = run_level(port, cookie, args.mix, vehicles, args.customers, args.seed, concurrency, args.duration)
+            print(f'并发 {concurrency}：{level["throughput"]} 请求/秒，p99 {level.get("latency_ms", {}).get("p99")} ms，错误 {level["errors"]}', file=sys.stderr)
+            levels.append(level)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        app.database_pool.invalidate()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    report = {
+        'config': {
+            'engine': args.engine,
+            'mode': args.mode,
+            'workers': args.workers,
+            'backlog': args.backlog,
+            'pool_size': app.database_pool.size,
+            'commit_window_ms': args.commit_window,
+            'database': args.database,
+            'seeded': seeded,
+            'manufacturers': args.manufacturers,
+            'models': args.models,
+            'customers': args.customers,
+            'transactions': args.transactions,
+            'stock': args.stock,
+            'mix': args.mix,
+            'seed': args.seed,
+            'python': sys.version.split()[0],
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'levels': levels,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
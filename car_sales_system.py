@@ -1,19 +1,1846 @@
 import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import csv
+import datetime
+import email.utils
+import gzip
+import hashlib
+import html
+import io
+import itertools
+import mimetypes
+import multiprocessing
 import os
+import http.cookies
 import http.server
 import json
+import queue
+import random
+import re
+import secrets
+import shutil
+import signal
+import socket
 import socketserver
 import sqlite3
-from urllib.parse import urlparse, parse_qs
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# 数据库文件
+DATABASE = 'car_sales.db'
+
+# 登录会话保存在数据库旁的单独文件中，各连接以 auth 为名附加。会话的写入不提交到主数据库，
+# 因此不改变主数据库的 PRAGMA data_version，登录、登出不会令 ETag 与片段缓存失效
+def sessions_database(database):
+    root, ext = os.path.splitext(database)
+    return f'{root}-sessions{ext or ".db"}'
+
+# 会话文件的表结构，每个连接附加会话文件后执行
+SESSIONS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS auth.sessions (
+           token TEXT PRIMARY KEY,
+           username TEXT NOT NULL,
+           role TEXT NOT NULL,
+           fingerprint TEXT NOT NULL,
+           expires REAL NOT NULL
+       ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS auth.sessions_expires ON sessions (expires)',
+]
+
+# 数据库与会话文件，以及两者的 WAL 日志与共享内存文件
+def database_files(database):
+    return [path + suffix for path in (database, sessions_database(database)) for suffix in ('', '-wal', '-shm')]
+
+# 连接池中的数据库连接：close() 时归还连接池而不真正关闭
+class PooledConnection(sqlite3.Connection):
+    pool = None
+    depth = 0
+    generation = 0
+
+    def close(self):
+        self.pool.release(self)
+
+# SQLite 连接池：空闲连接保持打开以复用其预编译语句缓存，同一线程内的嵌套借用共享同一连接
+class ConnectionPool:
+    def __init__(self, database, size=16, cached_statements=256, busy_timeout=5.0):
+        self.database = database
+        self.size = size
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.idle = []
+        self.open_count = 0
+        # 数据库文件被重建时递增，旧连接归还时直接关闭
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.stats = {'opens': 0, 'reuses': 0, 'waits': 0}
+
+    # 打开新连接
+    def open(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False, cached_statements=self.cached_statements, timeout=self.busy_timeout)
+        # WAL 模式下读者不会被写事务阻塞
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('ATTACH DATABASE ? AS auth', (sessions_database(self.database),))
+        conn.execute('PRAGMA auth.journal_mode=WAL')
+        for statement in SESSIONS_SCHEMA:
+            conn.execute(statement)
+        conn.pool = self
+        conn.generation = self.generation
+        sql_tracer.install(conn)
+        return conn
+
+    # 借出连接：优先复用本线程已借出的连接，其次复用空闲连接，连接数达到上限时等待归还
+    def acquire(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.depth += 1
+            return conn
+        with self.condition:
+            waited = False
+            while True:
+                while self.idle:
+                    conn = self.idle.pop()
+                    if conn.generation == self.generation:
+                        break
+                    sqlite3.Connection.close(conn)
+                    self.open_count -= 1
+                    conn = None
+                if conn is not None:
+                    self.stats['reuses'] += 1
+                    break
+                if self.open_count < self.size:
+                    self.open_count += 1
+                    self.stats['opens'] += 1
+                    break
+                if not waited:
+                    waited = True
+                    self.stats['waits'] += 1
+                self.condition.wait()
+        if conn is None:
+            try:
+                conn = self.open()
+            except Exception:
+                with self.condition:
+                    self.open_count -= 1
+                    self.condition.notify()
+                raise
+        conn.depth = 1
+        self.local.conn = conn
+        return conn
+
+    # 归还连接：最外层归还时回滚未提交的事务
+    def release(self, conn):
+        if conn.depth == 0:
+            return
+        conn.depth -= 1
+        if conn.depth > 0:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self.local.conn = None
+        with self.condition:
+            if conn.generation == self.generation:
+                self.idle.append(conn)
+            else:
+                sqlite3.Connection.close(conn)
+                self.open_count -= 1
+            self.condition.notify()
+
+    # 废弃所有现有连接（数据库文件被重建时调用）
+    def invalidate(self):
+        with self.condition:
+            self.generation += 1
+            for conn in self.idle:
+                sqlite3.Connection.close(conn)
+            self.open_count -= len(self.idle)
+            self.idle = []
+            self.condition.notify_all()
+
+    # 连接池统计信息
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, open=self.open_count, idle=len(self.idle), size=self.size)
+
+database_pool = ConnectionPool(DATABASE)
+
+# 数据库变更计数：专用连接从不写入，其 PRAGMA data_version 在任何其他连接（包括其他进程）提交后都会变化
+class DataVersion:
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.conn = None
+        self.generation = None
+        # 每次重新打开专用连接时递增，避免与旧连接的计数混淆
+        self.epoch = 0
+        self.token = f'{os.getpid():x}{int(time.time()):x}'
+
+    # 丢弃专用连接并生成新的标识（创建工作进程前后调用）。各进程的计数来自不同的连接而无法相互比较，
+    # 标识中包含进程号，其他进程生成的 ETag 不会被误认为未变化
+    def reset(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            self.token = f'{os.getpid():x}{int(time.time()):x}'
+
+    # 当前数据版本，可直接用作 ETag 的一部分
+    def get(self):
+        with self.lock:
+            if self.conn is None or self.generation != self.pool.generation:
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = sqlite3.connect(self.pool.database, check_same_thread=False)
+                self.generation = self.pool.generation
+                self.epoch += 1
+            version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        return f'{self.token}.{self.epoch}.{version}'
+
+data_version = DataVersion(database_pool)
 
 # 连接到 SQLite 数据库（如果数据库不存在，则会自动创建）
 def connect_to_database():
-    conn = sqlite3.connect('car_sales.db')
+    conn = database_pool.acquire()
     cursor = conn.cursor()
     return conn, cursor
 
+# 延迟直方图的桶上限，单位为秒
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 直方图：落在各个桶中的次数与总和
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+# 以 Prometheus 文本格式输出直方图，labels 为已格式化的标签（不含花括号）
+def render_histogram(name, labels, counts, total, count, buckets=LATENCY_BUCKETS):
+    lines = []
+    cumulative = 0
+    for bucket, bucket_count in zip(buckets + ('+Inf',), counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
+
+# 运行指标：请求数、处理中的请求数、按路径与状态码的请求延迟、按名称的数据库查询耗时。
+# 每次记录只在锁内更新几个计数，可在满负载下保持开启；/metrics 以 Prometheus 文本格式输出。
+# 多进程模式下各工作进程每秒把自己的指标写入共享目录中的文件，/metrics 汇集全部工作进程的指标，
+# 以 worker 标签（工作进程的序号，重新创建的进程沿用原序号）区分，计数器不会因抓取落在不同进程上而倒退
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # (方法, 路径, 状态码) -> Histogram
+        self.requests = {}
+        # 查询名称 -> Histogram
+        self.queries = {}
+        # 多进程模式下的共享目录与本进程的序号
+        self.directory = None
+        self.worker = None
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, duration):
+        with self.lock:
+            self.in_flight -= 1
+            key = (method, route, status)
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(duration)
+
+    def observe_query(self, name, duration):
+        with self.lock:
+            histogram = self.queries.get(name)
+            if histogram is None:
+                histogram = self.queries[name] = Histogram()
+            histogram.observe(duration)
+
+    # 记录一段数据库操作的耗时
+    @contextlib.contextmanager
+    def time_query(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_query(name, time.perf_counter() - start)
+
+    # 本进程指标的快照（可编码为 JSON）
+    def snapshot(self):
+        with self.lock:
+            snapshot = {
+                'in_flight': self.in_flight,
+                'requests': [[list(key), histogram.counts[:], histogram.sum, histogram.count] for key, histogram in self.requests.items()],
+                'queries': [[name, histogram.counts[:], histogram.sum, histogram.count] for name, histogram in self.queries.items()],
+            }
+        snapshot['pool'] = database_pool.get_stats()
+        snapshot['writes'] = write_queue.get_stats()
+        snapshot['fragments'] = fragment_cache.get_stats()
+        return snapshot
+
+    # 把本进程的快照写入共享目录（先写临时文件再改名，读取方不会读到一半）
+    def publish(self):
+        path = os.path.join(self.directory, f'{self.worker}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path + '.tmp', path)
+
+    # 工作进程中定期写入快照
+    def start_publishing(self, directory, worker, interval=1.0):
+        self.directory = directory
+        self.worker = worker
+
+        def run():
+            while True:
+                try:
+                    self.publish()
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # 各进程的快照：[(worker 标签, 快照)]，本进程使用实时数据
+    def collect(self):
+        if self.directory is None:
+            return [('', self.snapshot())]
+        snapshots = {self.worker: self.snapshot()}
+        for name in os.listdir(self.directory):
+            worker, _, extension = name.partition('.')
+            if extension != 'json' or not worker.isdigit() or int(worker) == self.worker:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as file:
+                    snapshots[int(worker)] = json.load(file)
+            except (OSError, ValueError):
+                pass
+        return [(f'worker="{worker}"', snapshots[worker]) for worker in sorted(snapshots)]
+
+    # Prometheus 文本格式
+    def render(self):
+        snapshots = self.collect()
+        # 在已有标签前加上 worker 标签
+        def labels(worker, text=''):
+            return ','.join(part for part in (worker, text) if part)
+        def series(name, worker, text=''):
+            text = labels(worker, text)
+            return f'{name}{{{text}}}' if text else name
+        def request_labels(key):
+            return f'method="{key[0]}",route="{key[1]}",status="{key[2]}"'
+        lines = [
+            '# HELP car_sales_http_requests_total 已处理的 HTTP 请求数',
+            '# TYPE car_sales_http_requests_total counter',
+        ]
+        for worker, snapshot in snapshots:
+            lines += [series('car_sales_http_requests_total', worker, request_labels(key)) + f' {count}' for key, _, _, count in sorted(snapshot['requests'])]
+        lines += [
+            '# HELP car_sales_http_requests_in_flight 正在处理的 HTTP 请求数',
+            '# TYPE car_sales_http_requests_in_flight gauge',
+        ]
+        lines += [f'{series("car_sales_http_requests_in_flight", worker)} {snapshot["in_flight"]}' for worker, snapshot in snapshots]
+        lines += [
+            '# HELP car_sales_http_request_duration_seconds HTTP 请求处理耗时',
+            '# TYPE car_sales_http_request_duration_seconds histogram',
+        ]
+        for worker, snapshot in snapshots:
+            for key, counts, total, count in sorted(snapshot['requests']):
+                lines += render_histogram('car_sales_http_request_duration_seconds', labels(worker, request_labels(key)), counts, total, count)
+        lines += [
+            '# HELP car_sales_db_queries_total 按名称统计的数据库操作次数',
+            '# TYPE car_sales_db_queries_total counter',
+        ]
+        for worker, snapshot in snapshots:
+            lines += [series('car_sales_db_queries_total', worker, f'query="{name}"') + f' {count}' for name, _, _, count in sorted(snapshot['queries'])]
+        lines += [
+            '# HELP car_sales_db_query_duration_seconds 按名称统计的数据库操作耗时',
+            '# TYPE car_sales_db_query_duration_seconds histogram',
+        ]
+        for worker, snapshot in snapshots:
+            for name, counts, total, count in sorted(snapshot['queries']):
+                lines += render_histogram('car_sales_db_query_duration_seconds', labels(worker, f'query="{name}"'), counts, total, count)
+        for name, help_text, metric_type, section, key in (
+            ('car_sales_db_connection_opens_total', '打开的数据库连接数', 'counter', 'pool', 'opens'),
+            ('car_sales_db_connection_reuses_total', '复用空闲连接的次数', 'counter', 'pool', 'reuses'),
+            ('car_sales_db_connection_waits_total', '等待连接归还的次数', 'counter', 'pool', 'waits'),
+            ('car_sales_db_connections_open', '当前打开的数据库连接数', 'gauge', 'pool', 'open'),
+            ('car_sales_db_connections_idle', '当前空闲的数据库连接数', 'gauge', 'pool', 'idle'),
+            ('car_sales_db_commits_total', '写线程提交的事务数', 'counter', 'writes', 'commits'),
+            ('car_sales_db_rollbacks_total', '写线程回滚的事务数', 'counter', 'writes', 'rollbacks'),
+            ('car_sales_db_write_jobs_total', '写线程执行的写入任务数', 'counter', 'writes', 'jobs'),
+            ('car_sales_fragment_cache_hits_total', '片段缓存命中次数', 'counter', 'fragments', 'hits'),
+            ('car_sales_fragment_cache_misses_total', '片段缓存未命中（重新生成）次数', 'counter', 'fragments', 'misses'),
+            ('car_sales_fragment_cache_evictions_total', '片段缓存因超过容量淘汰的条目数', 'counter', 'fragments', 'evictions'),
+            ('car_sales_fragment_cache_entries', '片段缓存中的条目数', 'gauge', 'fragments', 'entries'),
+            ('car_sales_fragment_cache_bytes', '片段缓存占用的字节数', 'gauge', 'fragments', 'bytes'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            lines += [f'{series(name, worker)} {snapshot[section][key]}' for worker, snapshot in snapshots]
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# 一个请求的 SQL 跟踪记录
+class TraceContext:
+    def __init__(self, request_id, route):
+        self.request_id = request_id
+        self.route = route
+        self.statements = 0
+        self.elapsed = 0.0
+        # 去掉字面量后的语句 -> 执行次数
+        self.shapes = collections.Counter()
+
+# SQL 跟踪（默认关闭）：通过 sqlite3 的 trace 回调记录每条语句，并标记发出语句的请求编号与路径。
+# 回调只在语句开始时触发，语句耗时取到同一线程下一条语句开始（或请求结束）为止，包含读取结果行的时间。
+# 超过阈值的语句写入慢查询日志；请求结束时，语句总数或同一形状语句的重复次数超过预算的请求（如逐行子查询）也写入日志。
+# 日志每行一个 JSON 对象
+class SqlTracer:
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_ms = 100.0
+        self.statement_budget = 50
+        self.repeat_budget = 10
+        self.log = sys.stderr
+        self.log_lock = threading.Lock()
+        self.local = threading.local()
+        self.request_ids = itertools.count(1)
+
+    # 为新打开的连接安装回调
+    def install(self, conn):
+        if self.enabled:
+            conn.set_trace_callback(self.trace)
+
+    # 当前线程正在跟踪的请求
+    def current(self):
+        return getattr(self.local, 'context', None)
+
+    # 开始跟踪一个请求
+    def begin(self, route):
+        self.switch(TraceContext(next(self.request_ids), route))
+
+    # 结束当前请求的跟踪，检查语句预算
+    def end(self):
+        context = self.current()
+        self.switch(None)
+        if context is None:
+            return
+        repeated = [(shape, count) for shape, count in context.shapes.most_common(5) if count > self.repeat_budget]
+        if context.statements > self.statement_budget or repeated:
+            self.write({
+                'event': 'statement_budget',
+                'request': context.request_id,
+                'route': context.route,
+                'statements': context.statements,
+                'ms': round(context.elapsed * 1000, 3),
+                'repeated': [{'sql': shape, 'count': count} for shape, count in repeated],
+            })
+
+    # 把当前线程之后的语句记到另一个请求上（写线程依次执行各请求的写入任务时使用），返回原来的请求
+    def switch(self, context):
+        previous = self.current()
+        self.finish(time.perf_counter())
+        self.local.context = context
+        return previous
+
+    # trace 回调：结束上一条语句的计时并开始计时这一条
+    def trace(self, statement):
+        now = time.perf_counter()
+        self.finish(now)
+        self.local.pending = (statement, now)
+
+    # 结束当前线程上一条语句的计时
+    def finish(self, now):
+        pending = getattr(self.local, 'pending', None)
+        if pending is None:
+            return
+        self.local.pending = None
+        statement, start = pending
+        elapsed = now - start
+        context = self.current()
+        if context is not None:
+            context.statements += 1
+            context.elapsed += elapsed
+            context.shapes[statement_shape(statement)] += 1
+        if elapsed * 1000 >= self.slow_query_ms:
+            self.write({
+                'event': 'slow_query',
+                'request': context.request_id if context else None,
+                'route': context.route if context else None,
+                'thread': threading.current_thread().name,
+                'ms': round(elapsed * 1000, 3),
+                'sql': ' '.join(statement.split()),
+            })
+
+    # 写入一行日志
+    def write(self, record):
+        line = json.dumps(dict(time=round(time.time(), 3), **record), ensure_ascii=False)
+        with self.log_lock:
+            self.log.write(line + '\n')
+            self.log.flush()
+
+sql_tracer = SqlTracer()
+
+# 语句的形状：字符串与数字字面量替换为 ?，用于发现重复执行的同一查询
+def statement_shape(statement):
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    return ' '.join(statement.split())
+
+# 指标中使用的动态路径，其他未知路径统一记为 other，避免任意 URL 产生过多的时间序列
+METRICS_ROUTES = {'/inventory_management.html', '/vehicles_management.html', '/logout', '/login', '/export/financials',
+                  '/add_message', '/add_messages', '/console', '/metrics'}
+
+# 请求在指标中的路径标签
+def metrics_route(path):
+    path = urlparse(path).path
+    if path in METRICS_ROUTES or path in API_ROUTES or path in STATIC_ASSETS:
+        return path
+    return 'other'
+
+# 写入失败，附带返回给客户端的状态码与信息
+class WriteError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+# 写入队列中的一项写入任务
+class WriteJob:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # 提交任务的请求，写线程执行任务时的 SQL 记到该请求上
+        self.trace_context = sql_tracer.current()
+
+    # 等待任务完成并返回结果
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+# 组提交写入队列：由单个写线程把提交窗口内到达的写入任务合并为一个事务提交，
+# 每个任务在独立的保存点中执行，失败时只回滚自身
+class WriteQueue:
+    def __init__(self, window=0.002, max_batch=256):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {'commits': 0, 'rollbacks': 0, 'jobs': 0}
+
+    # 提交写入任务并等待结果，func 的第一个参数为写线程的游标
+    def submit(self, func, *args):
+        self.start()
+        job = WriteJob(func, args)
+        self.queue.put(job)
+        return job.wait()
+
+    # 按需启动写线程
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='writer', daemon=True)
+                self.thread.start()
+
+    # 写线程主循环
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        batch.append(self.queue.get(timeout=timeout))
+                    else:
+                        batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    # 在一个事务中执行一批写入任务
+    def commit(self, batch):
+        try:
+            conn, cursor = connect_to_database()
+        except Exception as e:
+            for job in batch:
+                job.error = e
+                job.done.set()
+            return
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                sql_tracer.switch(job.trace_context)
+                cursor.execute('SAVEPOINT job')
+                mark = identity_cache.mark()
+                try:
+                    with metrics.time_query(job.func.__name__):
+                        job.result = job.func(cursor, *job.args)
+                    cursor.execute('RELEASE job')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO job')
+                    cursor.execute('RELEASE job')
+                    identity_cache.rollback_to(mark)
+                    job.error = e
+            sql_tracer.switch(None)
+            with metrics.time_query('write_commit'):
+                conn.commit()
+            identity_cache.publish()
+            self.stats['commits'] += 1
+        except Exception as e:
+            conn.rollback()
+            identity_cache.discard()
+            self.stats['rollbacks'] += 1
+            for job in batch:
+                if job.error is None:
+                    job.error = e
+        finally:
+            conn.close()
+            sql_tracer.switch(None)
+            self.stats['jobs'] += len(batch)
+            for job in batch:
+                job.done.set()
+
+    # 写线程统计信息
+    def get_stats(self):
+        return dict(self.stats)
+
+write_queue = WriteQueue()
+
+# 缓存版本：保存在各工作进程共享的内存中。任何进程修改了某类数据时递增对应的版本，
+# 其他进程在处理下一个请求前发现版本变化并清空本进程中相应的缓存
+class SharedEpoch:
+    def __init__(self):
+        self.value = multiprocessing.RawValue('Q', 0)
+        self.lock = multiprocessing.Lock()
+        self.seen = 0
+
+    # 递增版本
+    def bump(self):
+        with self.lock:
+            self.value.value += 1
+            self.seen = self.value.value
+
+    # 自上次检查以来版本是否变化
+    def changed(self):
+        value = self.value.value
+        if value == self.seen:
+            return False
+        self.seen = value
+        return True
+
+# 厂商、车辆与客户（名称缓存与前缀索引）
+cache_epoch = SharedEpoch()
+# 登录会话
+session_epoch = SharedEpoch()
+# 数据库文件（reset-database 重建后，各进程须丢弃指向旧文件的连接）
+database_epoch = SharedEpoch()
+
+# 名称 -> 编号缓存：厂商名称、(品牌, 型号, 厂商编号) 与客户名称分别映射到行编号。
+# 启动时预热，未命中时查询数据库并缓存；写事务中新插入的行先暂存在写线程内，提交后才对其他线程可见；
+# /console 与重建数据库会清空缓存
+class IdentityCache:
+    kinds = ('manufacturer', 'vehicle', 'customer')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.maps = {kind: {} for kind in self.kinds}
+        self.local = threading.local()
+
+    # 从数据库加载全部映射
+    def warm(self):
+        conn, cursor = connect_to_database()
+        try:
+            maps = {
+                'manufacturer': dict(cursor.execute('SELECT name, id FROM manufacturers')),
+                'vehicle': {(brand, model, manufacturer_id): vehicle_id for vehicle_id, brand, model, manufacturer_id in cursor.execute('SELECT id, brand, model, manufacturer_id FROM vehicles')},
+                'customer': dict(cursor.execute('SELECT name, id FROM customers')),
+            }
+        finally:
+            conn.close()
+        with self.lock:
+            self.maps = maps
+
+    # 当前线程暂存的新行：(映射, 撤销日志)
+    def pending(self):
+        if not hasattr(self.local, 'maps'):
+            self.local.maps = {kind: {} for kind in self.kinds}
+            self.local.log = []
+        return self.local.maps, self.local.log
+
+    # 查找编号，未知时返回 None
+    def get(self, kind, key):
+        pending_maps, _ = self.pending()
+        row_id = pending_maps[kind].get(key)
+        if row_id is None:
+            with self.lock:
+                row_id = self.maps[kind].get(key)
+        return row_id
+
+    # 缓存已提交的行
+    def add(self, kind, key, row_id):
+        with self.lock:
+            self.maps[kind][key] = row_id
+        prefix_index.add_identity(kind, key)
+
+    # 暂存当前写事务中插入的行
+    def stage(self, kind, key, row_id):
+        pending_maps, log = self.pending()
+        pending_maps[kind][key] = row_id
+        log.append((kind, key))
+
+    # 暂存位置，配合保存点使用
+    def mark(self):
+        return len(self.pending()[1])
+
+    # 回滚到暂存位置
+    def rollback_to(self, mark):
+        pending_maps, log = self.pending()
+        while len(log) > mark:
+            kind, key = log.pop()
+            pending_maps[kind].pop(key, None)
+
+    # 事务提交后公开暂存的行
+    def publish(self):
+        pending_maps, log = self.pending()
+        with self.lock:
+            for kind in self.kinds:
+                self.maps[kind].update(pending_maps[kind])
+        for kind in self.kinds:
+            for key in pending_maps[kind]:
+                prefix_index.add_identity(kind, key)
+        self.discard()
+
+    # 事务回滚后丢弃暂存的行
+    def discard(self):
+        pending_maps, log = self.pending()
+        for kind in self.kinds:
+            pending_maps[kind].clear()
+        log.clear()
+
+    # 清空缓存
+    def invalidate(self):
+        with self.lock:
+            self.maps = {kind: {} for kind in self.kinds}
+
+# 前缀索引：品牌、型号、厂商与客户名称分别保存在有序列表中，按前缀二分查找候选项。
+# 首次使用时从数据库加载，名称缓存收到新行时同步加入，/console 执行后清空重建
+class PrefixIndex:
+    queries = {
+        'brand': 'SELECT DISTINCT brand FROM vehicles',
+        'model': 'SELECT DISTINCT model FROM vehicles',
+        'manufacturer': 'SELECT name FROM manufacturers',
+        'customer': 'SELECT name FROM customers',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = None
+        self.loaded = 0
+        # 加载后超过 max_age 秒重新加载（多进程模式使用），None 表示不过期
+        self.max_age = None
+
+    # 从数据库加载全部取值
+    def load(self):
+        conn, cursor = connect_to_database()
+        try:
+            values = {field: sorted(row[0] for row in cursor.execute(query) if row[0] is not None) for field, query in self.queries.items()}
+        finally:
+            conn.close()
+        with self.lock:
+            if self.values is None or self.expired():
+                self.values = values
+                self.loaded = time.monotonic()
+            return self.values
+
+    # 是否需要重新加载
+    def expired(self):
+        return self.max_age is not None and time.monotonic() - self.loaded > self.max_age
+
+    # 返回以 prefix 开头的前 limit 个取值
+    def suggest(self, field, prefix, limit=20):
+        values = self.values
+        if values is None or self.expired():
+            values = self.load()
+        with self.lock:
+            values = values[field]
+            start = bisect.bisect_left(values, prefix)
+            result = []
+            for value in values[start:start + limit]:
+                if not value.startswith(prefix):
+                    break
+                result.append(value)
+        return result
+
+    # 加入一个取值
+    def add(self, field, value):
+        with self.lock:
+            if self.values is None:
+                return
+            values = self.values[field]
+            index = bisect.bisect_left(values, value)
+            if index == len(values) or values[index] != value:
+                values.insert(index, value)
+
+    # 按名称缓存的键加入取值
+    def add_identity(self, kind, key):
+        if kind == 'vehicle':
+            self.add('brand', key[0])
+            self.add('model', key[1])
+        else:
+            self.add(kind, key)
+
+    # 清空索引
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+
+prefix_index = PrefixIndex()
+
+identity_cache = IdentityCache()
+
+# 片段缓存：保存已编码的页面片段与接口正文，键为片段名称，条目记录生成时的数据版本。
+# 数据版本（PRAGMA data_version）在任何连接提交后都会变化，版本不同的条目视为过期并重新生成；
+# 总字节数超过上限时淘汰最久未使用的条目
+class FragmentCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        # 片段名称 -> (数据版本, 正文)，按最近使用顺序排列
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    # 返回数据版本为 version 的片段，缓存中没有时调用 build() 生成（须返回 bytes）。
+    # version 须在查询前取得，生成期间有新的提交时，下次读取会因版本不同而重新生成
+    def get(self, name, version, build):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(name)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+        body = build()
+        self.put(name, version, body)
+        return body
+
+    # 保存片段，超过上限的片段不保存
+    def put(self, name, version, body):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+            if len(body) > self.max_bytes:
+                return
+            self.entries[name] = (version, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    # 清空缓存
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size)
+
+fragment_cache = FragmentCache()
+
+# 解析厂商编号，不存在时按需创建
+def resolve_manufacturer(cursor, name, create=False):
+    manufacturer_id = identity_cache.get('manufacturer', name)
+    if manufacturer_id is None:
+        row = cursor.execute('SELECT id FROM manufacturers WHERE name=?', (name,)).fetchone()
+        if row is not None:
+            manufacturer_id = row[0]
+            identity_cache.add('manufacturer', name, manufacturer_id)
+        elif create:
+            cursor.execute('INSERT INTO manufacturers (name) VALUES (?)', (name,))
+            manufacturer_id = cursor.lastrowid
+            identity_cache.stage('manufacturer', name, manufacturer_id)
+    return manufacturer_id
+
+# 解析车辆编号，不存在时按需创建，返回 (车辆编号, 是否新建)
+def resolve_vehicle(cursor, brand, model, manufacturer_id, create=False):
+    key = (brand, model, manufacturer_id)
+    vehicle_id = identity_cache.get('vehicle', key)
+    if vehicle_id is None:
+        row = cursor.execute('SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=?', key).fetchone()
+        if row is not None:
+            vehicle_id = row[0]
+            identity_cache.add('vehicle', key, vehicle_id)
+        elif create:
+            cursor.execute('INSERT INTO vehicles (brand, model, manufacturer_id) VALUES (?, ?, ?)', key)
+            vehicle_id = cursor.lastrowid
+            identity_cache.stage('vehicle', key, vehicle_id)
+            return vehicle_id, True
+    return vehicle_id, False
+
+# 解析客户编号，不存在时创建
+def resolve_customer(cursor, name):
+    customer_id = identity_cache.get('customer', name)
+    if customer_id is None:
+        row = cursor.execute('SELECT id FROM customers WHERE name=?', (name,)).fetchone()
+        if row is not None:
+            customer_id = row[0]
+            identity_cache.add('customer', name, customer_id)
+        else:
+            cursor.execute('INSERT INTO customers (name) VALUES (?)', (name,))
+            customer_id = cursor.lastrowid
+            identity_cache.stage('customer', name, customer_id)
+    return customer_id
+
+# 把一笔卖出累加到销售日记录与销售月记录中
+def add_sales_rollup(cursor, vehicle_id, day, amount):
+    cursor.execute('''
+        INSERT INTO sales_daily (vehicle_id, day, amount) VALUES (?, ?, ?)
+        ON CONFLICT (vehicle_id, day) DO UPDATE SET amount = amount + excluded.amount
+    ''', (vehicle_id, day, amount))
+    cursor.execute('''
+        INSERT INTO sales_monthly (vehicle_id, month, amount) VALUES (?, ?, ?)
+        ON CONFLICT (vehicle_id, month) DO UPDATE SET amount = amount + excluded.amount
+    ''', (vehicle_id, day[:7], amount))
+
+# 根据财务信息重建销售日记录与销售月记录的语句
+REBUILD_SALES_ROLLUPS = [
+    'DELETE FROM sales_daily',
+    '''INSERT INTO sales_daily (vehicle_id, day, amount)
+       SELECT vehicle_id, date, SUM(amount) FROM financials
+       WHERE transaction_type = '卖出' AND vehicle_id IS NOT NULL AND date IS NOT NULL
+       GROUP BY vehicle_id, date''',
+    'DELETE FROM sales_monthly',
+    '''INSERT INTO sales_monthly (vehicle_id, month, amount)
+       SELECT vehicle_id, substr(day, 1, 7), SUM(amount) FROM sales_daily
+       GROUP BY vehicle_id, substr(day, 1, 7)''',
+]
+
+# 重建销售日记录与销售月记录
+def rebuild_sales_rollups():
+    conn, cursor = connect_to_database()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for statement in REBUILD_SALES_ROLLUPS:
+            cursor.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+    return '销售日记录与销售月记录重建成功'
+
+# 交易类型参数与数据库中取值的对应关系
+TRANSACTION_TYPES = {'buy': '买入', 'sell': '卖出', '买入': '买入', '卖出': '卖出'}
+
+# 解析分页游标“日期,编号”
+def parse_page_cursor(token):
+    date, _, financial_id = token.rpartition(',')
+    if not date or not financial_id.isdigit():
+        return None
+    return date, int(financial_id)
+
+# 解析每页行数，限制在 1 到 500 之间
+def parse_page_size(value, default=50):
+    try:
+        return min(max(int(value), 1), 500)
+    except ValueError:
+        return default
+
+# 按 (日期, 编号) 倒序分页查询交易信息，返回 (行, 上一页游标, 下一页游标)
+# before 取游标之前（更早）的一页，after 取游标之后（更新）的一页
+def query_transactions(cursor, brand='', customer='', transaction_type='', before='', after='', page_size=50):
+    conditions = ['t0.vehicle_id = t1.id', 't0.customer_id = t2.id', 't1.manufacturer_id = t3.id']
+    params = []
+    if brand:
+        conditions.append('t1.brand = ?')
+        params.append(brand)
+    if customer:
+        conditions.append('t2.name = ?')
+        params.append(customer)
+    if transaction_type:
+        conditions.append('t0.transaction_type = ?')
+        params.append(TRANSACTION_TYPES.get(transaction_type, transaction_type))
+    key = parse_page_cursor(after or before or '')
+    if key:
+        conditions.append('(t0.date, t0.id) > (?, ?)' if after else '(t0.date, t0.id) < (?, ?)')
+        params.extend(key)
+    order = 'ASC' if after and key else 'DESC'
+    with metrics.time_query('transactions'):
+        cursor.execute(f'''
+            SELECT t0.id, t1.brand, t1.model, t3.name, t0.transaction_type, t0.amount, t2.name, t0.date
+            FROM financials t0, vehicles t1, customers t2, manufacturers t3
+            WHERE {' AND '.join(conditions)}
+            ORDER BY t0.date {order}, t0.id {order}
+            LIMIT ?
+        ''', params + [page_size + 1])
+        rows = cursor.fetchall()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if order == 'ASC':
+        rows.reverse()
+        newer, older = more, True
+    else:
+        newer, older = bool(key), more
+    if not rows:
+        return rows, None, None
+    prev_cursor = f'{rows[0][7]},{rows[0][0]}' if newer else None
+    next_cursor = f'{rows[-1][7]},{rows[-1][0]}' if older else None
+    return rows, prev_cursor, next_cursor
+
+# 查询车辆库存及今日、本月的卖出数量
+def query_inventory(cursor):
+    with metrics.time_query('inventory'):
+        cursor.execute('''
+            select brand, model, quantity, sales_daily.amount, sales_monthly.amount
+            from inventory
+            join vehicles on vehicles.id = inventory.vehicle_id
+            left join sales_daily on sales_daily.vehicle_id = vehicles.id and sales_daily.day = date('now')
+            left join sales_monthly on sales_monthly.vehicle_id = vehicles.id and sales_monthly.month = strftime('%Y-%m', 'now')
+        ''')
+        return cursor.fetchall()
+
+# 库存接口
+def api_inventory(cursor, query_params):
+    return [
+        {'brand': brand, 'model': model, 'quantity': quantity, 'today': today or 0, 'month': month or 0}
+        for brand, model, quantity, today, month in query_inventory(cursor)
+    ]
+
+# 交易信息接口
+def api_transactions(cursor, query_params):
+    param = lambda key: query_params.get(key, [''])[0]
+    rows, prev_cursor, next_cursor = query_transactions(
+        cursor, param('brand'), param('customer'), param('type'), param('before'), param('after'), parse_page_size(param('size')))
+    keys = ('id', 'brand', 'model', 'manufacturer', 'type', 'amount', 'customer', 'date')
+    return {'rows': [dict(zip(keys, row)) for row in rows], 'prev': prev_cursor, 'next': next_cursor}
+
+# 选项接口
+def api_options(cursor, query_params):
+    options = {}
+    with metrics.time_query('options'):
+        for key, attribute, table_name in (('brand', 'brand', 'vehicles'), ('model', 'model', 'vehicles'), ('manufacturer', 'name', 'manufacturers'), ('customer', 'name', 'customers')):
+            cursor.execute(f'SELECT DISTINCT {attribute} FROM {table_name}')
+            options[key] = [row[0] for row in cursor]
+    return options
+
+# 候选项接口
+def api_suggest(cursor, query_params):
+    field = query_params.get('field', [''])[0]
+    if field not in PrefixIndex.queries:
+        return []
+    limit = parse_page_size(query_params.get('limit', [''])[0], 20)
+    return prefix_index.suggest(field, query_params.get('prefix', [''])[0], limit)
+
+# 进销存统计的分组方式：名称 -> (输出的列, 分组表达式)
+REPORT_GROUPS = {
+    'vehicle': ((('brand', 'vehicles.brand'), ('model', 'vehicles.model'), ('manufacturer', 'manufacturers.name')), 'vehicles.id'),
+    'brand': ((('brand', 'vehicles.brand'),), 'vehicles.brand'),
+    'manufacturer': ((('manufacturer', 'manufacturers.name'),), 'manufacturers.id'),
+}
+
+# 进销存统计的周期：名称 -> 由日期得到周期标签的表达式（按周统计时以周一的日期为标签）
+REPORT_GRANULARITIES = {
+    'day': 'financials.date',
+    'week': "date(financials.date, '-6 days', 'weekday 1')",
+    'month': 'substr(financials.date, 1, 7)',
+}
+
+# 一次统计最多包含的周期数
+REPORT_MAX_PERIODS = 400
+
+# 解析进销存统计的参数，返回 (参数, 错误信息)。默认统计本月（UTC）至今，按月、按车辆分组
+def parse_report_query(query_params):
+    param = lambda key, default='': query_params.get(key, [''])[0] or default
+    try:
+        end = datetime.date.fromisoformat(param('end', time.strftime('%Y-%m-%d', time.gmtime())))
+        start = datetime.date.fromisoformat(param('start', end.replace(day=1).isoformat()))
+    except ValueError:
+        return None, '日期格式应为 YYYY-MM-DD'
+    if start > end:
+        return None, '起始日期晚于截止日期'
+    granularity = param('granularity', 'month')
+    if granularity not in REPORT_GRANULARITIES:
+        return None, f'统计周期应为 {"、".join(REPORT_GRANULARITIES)}'
+    group = param('group', 'vehicle')
+    if group not in REPORT_GROUPS:
+        return None, f'分组方式应为 {"、".join(REPORT_GROUPS)}'
+    periods = report_periods(start, end, granularity)
+    if len(periods) > REPORT_MAX_PERIODS:
+        return None, f'周期数超过上限 {REPORT_MAX_PERIODS}，请缩小日期范围或改用更长的统计周期'
+    return {'start': start, 'end': end, 'granularity': granularity, 'group': group, 'periods': periods}, None
+
+# 日期范围内的各个周期：(标签, 起始日期, 截止日期)，首尾两个周期按日期范围截断
+def report_periods(start, end, granularity):
+    periods = []
+    day = start
+    while day <= end:
+        if granularity == 'day':
+            label, last = day.isoformat(), day
+        elif granularity == 'week':
+            monday = day - datetime.timedelta(days=day.weekday())
+            label, last = monday.isoformat(), monday + datetime.timedelta(days=6)
+        else:
+            label = day.strftime('%Y-%m')
+            last = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+        last = min(last, end)
+        periods.append((label, day.isoformat(), last.isoformat()))
+        day = last + datetime.timedelta(days=1)
+        if len(periods) > REPORT_MAX_PERIODS:
+            break
+    return periods
+
+# 历史版本（见版本 7 的迁移），不存在时返回 None
+def history_version(cursor):
+    try:
+        row = cursor.execute('SELECT version FROM history_version WHERE id = 1').fetchone()
+    except sqlite3.Error:
+        return None
+    return row and row[0]
+
+# 递增历史版本（在调用方的事务中执行）
+def bump_history_version(conn):
+    try:
+        conn.execute('UPDATE history_version SET version = version + 1 WHERE id = 1')
+    except sqlite3.Error:
+        pass
+
+# 进销存统计：各分组在每个周期的期初库存、买入、卖出、盘点调整与期末库存。
+# 库存以 inventory 中的当前数量为准向前推算：起始日期及以后的财务信息在一次扫描中按车辆与周期汇总（截止日期以后的汇总为一项），
+# 每辆车另有一行携带当前库存，按分组与周期合并后，以窗口函数从后向前累加各周期之后的变动，当前库存减去这些变动即为各周期的期末库存；
+# 携带当前库存的一行排在最后，得到的是起始日期的期初库存。没有变动的周期沿用上一周期的期末库存
+def query_report(cursor, report):
+    columns, group_by = REPORT_GROUPS[report['group']]
+    select = ', '.join(f'{expression} AS {name}' for name, expression in columns)
+    with metrics.time_query('reports'):
+        cursor.execute(f'''
+            WITH movements AS (
+                SELECT vehicle_id,
+                       CASE WHEN date > :end THEN '~' ELSE {REPORT_GRANULARITIES[report['granularity']]} END AS period,
+                       0 AS stock,
+                       SUM(CASE WHEN transaction_type = '买入' THEN amount ELSE 0 END) AS purchases,
+                       SUM(CASE WHEN transaction_type = '卖出' THEN amount ELSE 0 END) AS sales,
+                       SUM(CASE WHEN transaction_type = '盘点调整' THEN amount ELSE 0 END) AS adjustments
+                FROM financials
+                WHERE date >= :start
+                GROUP BY vehicle_id, period
+                UNION ALL
+                SELECT vehicle_id, '', quantity, 0, 0, 0 FROM inventory
+            ), grouped AS (
+                SELECT {group_by} AS group_id, {select}, period,
+                       SUM(stock) AS stock, SUM(purchases) AS purchases, SUM(sales) AS sales, SUM(adjustments) AS adjustments
+                FROM movements
+                JOIN vehicles ON vehicles.id = movements.vehicle_id
+                JOIN manufacturers ON manufacturers.id = vehicles.manufacturer_id
+                GROUP BY group_id, period
+            )
+            SELECT group_id, {', '.join(name for name, _ in columns)}, period, purchases, sales, adjustments,
+                   SUM(stock) OVER (PARTITION BY group_id)
+                   - COALESCE(SUM(purchases - sales + adjustments) OVER (PARTITION BY group_id ORDER BY period DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS closing
+            FROM grouped
+            ORDER BY group_id, period
+        ''', {'start': report['start'].isoformat(), 'end': report['end'].isoformat()})
+        rows = cursor.fetchall()
+    fields = ('opening', 'purchases', 'sales', 'adjustments', 'closing')
+    result = [{'period': label, 'start': first, 'end': last, 'rows': [], 'totals': dict.fromkeys(fields, 0)}
+              for label, first, last in report['periods']]
+    for _, group_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        group_rows = list(group_rows)
+        names = dict(zip((name for name, _ in columns), group_rows[0][1:1 + len(columns)]))
+        movements = {row[1 + len(columns)]: row[2 + len(columns):] for row in group_rows}
+        # 携带当前库存的一行：期末库存即起始日期的期初库存
+        stock = movements[''][3] if '' in movements else 0
+        for entry in result:
+            purchases, sales, adjustments, closing = movements.get(entry['period'], (0, 0, 0, stock))
+            if stock or purchases or sales or adjustments:
+                entry['rows'].append(dict(names, opening=stock, purchases=purchases, sales=sales, adjustments=adjustments, closing=closing))
+                for key, value in zip(fields, (stock, purchases, sales, adjustments, closing)):
+                    entry['totals'][key] += value
+            stock = closing
+    return {'start': report['start'].isoformat(), 'end': report['end'].isoformat(), 'granularity': report['granularity'], 'group': report['group'], 'periods': result}
+
+# 进销存统计接口（参数已由 handle_api 校验）
+def api_reports(cursor, query_params):
+    report, _ = parse_report_query(query_params)
+    return query_report(cursor, report)
+
+# JSON 数据接口
+API_ROUTES = {
+    '/api/inventory': api_inventory,
+    '/api/transactions': api_transactions,
+    '/api/options': api_options,
+    '/api/suggest': api_suggest,
+    '/api/reports': api_reports,
+}
+
+# 响应正文保存在片段缓存中的接口（候选项直接查询内存中的前缀索引，不缓存）
+CACHED_API_ROUTES = {'/api/inventory', '/api/transactions', '/api/options', '/api/reports'}
+
+# 导出财务信息的列
+EXPORT_COLUMNS = ('id', 'date', 'brand', 'model', 'manufacturer', 'operation', 'quantity', 'customer')
+
+# 按日期、车辆与客户筛选财务信息，按 (日期, 编号) 顺序逐行返回，不一次性读入内存
+def query_financials(cursor, start='', end='', brand='', model='', customer=''):
+    conditions = []
+    params = []
+    for condition, value in (('t0.date >= ?', start), ('t0.date <= ?', end), ('t1.brand = ?', brand), ('t1.model = ?', model), ('t2.name = ?', customer)):
+        if value:
+            conditions.append(condition)
+            params.append(value)
+    with metrics.time_query('export'):
+        cursor.execute(f'''
+            SELECT t0.id, t0.date, t1.brand, t1.model, t3.name, t0.transaction_type, t0.amount, t2.name
+            FROM financials t0
+            LEFT JOIN vehicles t1 ON t0.vehicle_id = t1.id
+            LEFT JOIN customers t2 ON t0.customer_id = t2.id
+            LEFT JOIN manufacturers t3 ON t1.manufacturer_id = t3.id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY t0.date, t0.id
+        ''', params)
+    return cursor
+
+# 把财务信息编码为 CSV 或 NDJSON，每批若干行返回一段字节
+def encode_financials(rows, file_format, batch_size=1000):
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        write = writer.writerow
+    else:
+        write = lambda row: buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n')
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+# 导出财务信息的筛选参数
+EXPORT_FILTERS = ('start', 'end', 'brand', 'model', 'customer')
+
+# 每批最多写入的记录数
+MAX_BATCH_RECORDS = 10000
+
+# 校验并整理客户端提交的一条记录，返回 (记录, 错误信息)
+def parse_record(data):
+    if not isinstance(data, dict):
+        return None, '记录格式有误'
+    for key in ('brand', 'model', 'manufacturer', 'customername'):
+        if not isinstance(data.get(key), str) or not data.get(key):
+            return None, f'缺少 {key}'
+    if data.get('operation') not in ('buy', 'sell'):
+        return None, '无效的操作'
+    try:
+        quantity = int(data.get('quantity'))
+    except (TypeError, ValueError):
+        return None, '数量有误'
+    if quantity < 1:
+        return None, '数量必须大于0！'
+    return (data['brand'], data['model'], data['manufacturer'], data['operation'], quantity, data['customername']), None
+
+# 批量写入中止，附带逐条结果
+class BatchError(WriteError):
+    def __init__(self, results):
+        super().__init__(400, '批量写入失败，已全部回滚')
+        self.results = results
+
+# 在同一事务中写入一批记录（在写线程的事务中执行），每条记录使用独立的保存点；
+# atomic 为真时任意一条失败即抛出 BatchError，由写入队列回滚整批
+def write_records(cursor, records, atomic=False):
+    results = []
+    for index, record in enumerate(records):
+        cursor.execute('SAVEPOINT record')
+        mark = identity_cache.mark()
+        try:
+            write_record(cursor, *record)
+            cursor.execute('RELEASE record')
+            results.append({'index': index, 'status': 'success'})
+        except WriteError as e:
+            cursor.execute('ROLLBACK TO record')
+            cursor.execute('RELEASE record')
+            identity_cache.rollback_to(mark)
+            results.append({'index': index, 'status': 'error', 'code': e.code, 'message': e.message})
+            if atomic:
+                for result in results[:-1]:
+                    result['status'] = 'rolled_back'
+                raise BatchError(results)
+    return results
+
+# 库存变动：按已解析的车辆编号增减库存并写入财务信息（在写线程的事务中执行）。
+# 卖出以带条件的 UPDATE 扣减库存，由影响的行数判断是否成功，检查与扣减之间不会被其他写入插入；
+# 买入以 upsert 一条语句完成新建或累加。customer 为客户名称，库存变动成功后才解析（必要时创建）
+def move_stock(cursor, vehicle_id, operation, quantity, customer):
+    today = time.strftime('%Y-%m-%d', time.gmtime())
+    if operation == 'sell':
+        cursor.execute('''
+            UPDATE inventory SET quantity = quantity - ? WHERE vehicle_id = ? AND quantity >= ?
+        ''', (quantity, vehicle_id, quantity))
+        if cursor.rowcount == 0:
+            # 只在失败时区分原因
+            if cursor.execute('SELECT 1 FROM inventory WHERE vehicle_id = ?', (vehicle_id,)).fetchone() is None:
+                print('无法卖出：车辆不存在')
+                raise WriteError(400, '车辆不存在')
+            print('无法卖出：库存不足')
+            raise WriteError(400, '库存不足')
+    else:
+        cursor.execute('''
+            INSERT INTO inventory (vehicle_id, quantity) VALUES (?, ?)
+            ON CONFLICT (vehicle_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', (vehicle_id, quantity))
+
+    # 查找或创建客户
+    customer_id = resolve_customer(cursor, customer)
+
+    # 添加财务信息
+    cursor.execute('''
+        INSERT INTO financials (vehicle_id, customer_id, transaction_type, amount, date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (vehicle_id, customer_id, TRANSACTION_TYPES[operation], quantity, today))
+
+    # 在同一事务中更新销售日记录与销售月记录
+    if operation == 'sell':
+        add_sales_rollup(cursor, vehicle_id, today, quantity)
+
+# 写入一条买入或卖出记录（在写线程的事务中执行）
+def write_record(cursor, brand, model, manufacturer, operation, quantity, customer_name):
+    # 买还是卖？
+    if operation == 'sell':
+        # 检查厂商与车辆是否存在（通常由名称缓存直接得到编号）
+        manufacturer_id = resolve_manufacturer(cursor, manufacturer)
+        if manufacturer_id is None:
+            print('无法卖出：厂商不存在')
+            raise WriteError(400, '厂商不存在')
+        vehicle_id, _ = resolve_vehicle(cursor, brand, model, manufacturer_id)
+        if vehicle_id is None:
+            print('无法卖出：车辆不存在')
+            raise WriteError(400, '车辆不存在')
+    elif operation == 'buy':
+        # 查找或创建厂商与车辆
+        manufacturer_id = resolve_manufacturer(cursor, manufacturer, create=True)
+        vehicle_id, _ = resolve_vehicle(cursor, brand, model, manufacturer_id, create=True)
+    else:
+        raise WriteError(400, '无效的操作')
+    move_stock(cursor, vehicle_id, operation, quantity, customer_name)
+
+# 控制台每次读取的行数与进度回调的间隔（虚拟机指令数）
+CONSOLE_FETCH_SIZE = 256
+CONSOLE_PROGRESS_STEPS = 1000
+
+# 进度回调统计的虚拟机指令数（只精确到回调间隔）
+def describe_progress(steps):
+    if steps < CONSOLE_PROGRESS_STEPS:
+        return f'执行不足 {CONSOLE_PROGRESS_STEPS} 条虚拟机指令'
+    return f'执行 {steps}～{steps + CONSOLE_PROGRESS_STEPS - 1} 条虚拟机指令（每 {CONSOLE_PROGRESS_STEPS} 条计数一次）'
+
+# 查询计划，子步骤按层级缩进
+def explain_query_plan(cursor, command):
+    depth = {0: 0}
+    lines = []
+    for node, parent, _, detail in cursor.execute('EXPLAIN QUERY PLAN ' + command).fetchall():
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append('  ' * (depth[node] - 1) + detail)
+    return '查询计划：<br><pre>' + html.escape('\n'.join(lines)) + '</pre>'
+
+# 登录会话
+class Session:
+    def __init__(self, username, role, fingerprint, expires):
+        self.username = username
+        self.role = role
+        self.fingerprint = fingerprint
+        self.expires = expires
+
+# 操作员信息的指纹，用户名、密码或角色变化后会话失效
+def operator_fingerprint(username, password, role):
+    return hashlib.sha256(f'{username}\0{password}\0{role}'.encode('utf-8')).hexdigest()
+
+# 数据库中保存的是令牌的摘要而不是令牌本身
+def session_key(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+# 保存会话（在写线程的事务中执行），同时删除过期的会话，超过数量上限时删除最早到期的会话
+def store_session(cursor, key, username, role, fingerprint, expires, max_sessions):
+    cursor.execute('DELETE FROM auth.sessions WHERE expires <= ?', (time.time(),))
+    cursor.execute('INSERT OR REPLACE INTO auth.sessions (token, username, role, fingerprint, expires) VALUES (?, ?, ?, ?, ?)', (key, username, role, fingerprint, expires))
+    cursor.execute('DELETE FROM auth.sessions WHERE token IN (SELECT token FROM auth.sessions ORDER BY expires DESC LIMIT -1 OFFSET ?)', (max_sessions,))
+
+# 延长会话的有效期（在写线程的事务中执行）
+def touch_session(cursor, key, expires):
+    cursor.execute('UPDATE auth.sessions SET expires = ? WHERE token = ?', (expires, key))
+
+# 删除会话（在写线程的事务中执行）
+def delete_session(cursor, key):
+    cursor.execute('DELETE FROM auth.sessions WHERE token = ?', (key,))
+
+# 删除用户名、密码或角色已变化的会话（在写线程的事务中执行）
+def revalidate_sessions(cursor):
+    usernames = [row[0] for row in cursor.execute('SELECT DISTINCT username FROM auth.sessions').fetchall()]
+    for username in usernames:
+        row = cursor.execute('SELECT password, role FROM operators WHERE username=?', (username,)).fetchone()
+        if row is None:
+            cursor.execute('DELETE FROM auth.sessions WHERE username = ?', (username,))
+        else:
+            cursor.execute('DELETE FROM auth.sessions WHERE username = ? AND fingerprint != ?', (username, operator_fingerprint(username, *row)))
+
+# 会话表：会话保存在会话文件的 sessions 表中，各进程按最近使用顺序在内存中缓存，页面请求通常只查询缓存。
+# 有效期在每次访问后顺延，数据库中的到期时间每隔 refresh_interval 秒才更新一次；
+# 撤销会话或操作员信息变化时删除数据库中的会话，并通过缓存版本通知所有进程清空缓存
+class SessionStore:
+    def __init__(self, ttl=28800, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # 令牌摘要 -> Session
+        self.sessions = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # 数据库中到期时间的更新间隔
+    @property
+    def refresh_interval(self):
+        return min(300, self.ttl / 10)
+
+    # 签发会话，返回令牌
+    def create(self, username, role, fingerprint):
+        token = secrets.token_urlsafe(32)
+        key = session_key(token)
+        session = Session(username, role, fingerprint, time.time() + self.ttl)
+        write_queue.submit(store_session, key, username, role, fingerprint, session.expires, self.max_sessions)
+        self.remember(key, session)
+        return token
+
+    # 查找会话并顺延有效期，不存在或已过期时返回 None
+    def get(self, token):
+        if not token:
+            return None
+        key = session_key(token)
+        now = time.time()
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions.move_to_end(key)
+        if session is None or session.expires <= now:
+            # 缓存中没有或已过期（其他进程可能已顺延），以数据库为准
+            conn, cursor = connect_to_database()
+            try:
+                row = cursor.execute('SELECT username, role, fingerprint, expires FROM auth.sessions WHERE token = ? AND expires > ?', (key, now)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                with self.lock:
+                    self.sessions.pop(key, None)
+                return None
+            session = Session(*row)
+            self.remember(key, session)
+        if session.expires - now < self.ttl - self.refresh_interval:
+            session.expires = now + self.ttl
+            write_queue.submit(touch_session, key, session.expires)
+        return session
+
+    # 缓存会话
+    def remember(self, key, session):
+        with self.lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    # 撤销会话
+    def revoke(self, token):
+        if not token:
+            return
+        key = session_key(token)
+        write_queue.submit(delete_session, key)
+        with self.lock:
+            self.sessions.pop(key, None)
+        session_epoch.bump()
+
+    # 与数据库中的操作员信息比对，撤销用户名、密码或角色已变化的会话
+    def revalidate(self):
+        write_queue.submit(revalidate_sessions)
+        self.forget()
+        session_epoch.bump()
+
+    # 清空本进程的缓存
+    def forget(self):
+        with self.lock:
+            self.sessions.clear()
+
+session_store = SessionStore()
+
+# 清空本进程的名称缓存、前缀索引与会话缓存，并通知其他工作进程
+def invalidate_caches():
+    identity_cache.invalidate()
+    prefix_index.invalidate()
+    session_store.forget()
+    cache_epoch.bump()
+    session_epoch.bump()
+
+# 其他工作进程修改过数据时清空本进程的缓存；数据库被重建时还要丢弃连接池中的连接与数据版本的专用连接
+def sync_caches():
+    if database_epoch.changed():
+        database_pool.invalidate()
+        data_version.reset()
+    if cache_epoch.changed():
+        identity_cache.invalidate()
+        prefix_index.invalidate()
+    if session_epoch.changed():
+        session_store.forget()
+
+# 会话 Cookie
+def session_cookie(token):
+    return f'session={token}; Path=/; HttpOnly; SameSite=Strict; Max-Age={session_store.ttl}'
+
+# 动态响应的正文写入器：正文在缓冲区内写完时带 Content-Length 发送，达到压缩阈值则整体 gzip 压缩；
+# 超出缓冲区时边生成边发送，按协商结果流式压缩，HTTP/1.1 客户端使用分块传输，HTTP/1.0 客户端以关闭连接结束正文
+class ResponseWriter:
+    buffer_size = 65536
+
+    def __init__(self, handler, code, content_type, headers={}):
+        self.handler = handler
+        self.code = code
+        self.content_type = content_type
+        self.headers = headers
+        self.buffer = bytearray()
+        self.started = False
+        self.compressor = None
+        self.chunked = False
+
+    # 写入一段正文
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) < self.buffer_size:
+            return
+        if not self.started:
+            self.start()
+        self.flush()
+
+    # 发送正文长度未知的响应头
+    def start(self):
+        handler = self.handler
+        self.chunked = handler.request_version == 'HTTP/1.1'
+        # 本身以 HTTP/1.1 运行的处理器（asyncio 前端）在分块传输结束后保持连接
+        keep_alive = self.chunked and handler.protocol_version == 'HTTP/1.1' and not handler.close_connection
+        if self.chunked:
+            handler.protocol_version = 'HTTP/1.1'
+        self.send_headers()
+        if accepts_encoding(handler.headers.get('Accept-Encoding', ''), 'gzip'):
+            self.compressor = zlib.compressobj(handler.gzip_level, zlib.DEFLATED, 31)
+            handler.send_header('Content-Encoding', 'gzip')
+        if self.chunked:
+            handler.send_header('Transfer-Encoding', 'chunked')
+        if not keep_alive:
+            handler.send_header('Connection', 'close')
+        handler.end_headers()
+        self.started = True
+
+    # 发送状态行与通用响应头
+    def send_headers(self):
+        handler = self.handler
+        handler.send_response(self.code)
+        handler.send_header('Content-type', self.content_type)
+        for key, value in self.headers.items():
+            handler.send_header(key, value)
+        handler.send_header('Vary', 'Accept-Encoding')
+
+    # 发送缓冲区中的正文
+    def flush(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.send(data)
+
+    # 按传输方式发送一段数据
+    def send(self, data):
+        if not data:
+            return
+        if self.chunked:
+            self.handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.handler.wfile.write(data)
+
+    # 结束响应
+    def close(self):
+        handler = self.handler
+        if not self.started:
+            body = bytes(self.buffer)
+            self.send_headers()
+            if len(body) >= handler.gzip_min_size and accepts_encoding(handler.headers.get('Accept-Encoding', ''), 'gzip'):
+                body = gzip.compress(body, handler.gzip_level)
+                handler.send_header('Content-Encoding', 'gzip')
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+        self.flush()
+        if self.compressor is not None:
+            self.send(self.compressor.flush())
+        if self.chunked:
+            handler.wfile.write(b'0\r\n\r\n')
+
+# 多线程服务器：每个请求一个线程
+class ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, backlog=64):
+        self.request_queue_size = backlog
+        super().__init__(server_address, RequestHandlerClass)
+
+# 有界线程池服务器：固定数量的工作线程处理请求，工作线程全忙时新连接留在监听队列中等待
+class PoolingServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, server_address, RequestHandlerClass, workers=8, backlog=64):
+        self.request_queue_size = backlog
+        self.idle_workers = threading.BoundedSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+        self.stopping = False
+        super().__init__(server_address, RequestHandlerClass)
+
+    def process_request(self, request, client_address):
+        # 没有空闲的工作线程时暂停 accept；等待期间定期检查是否正在关闭，关闭时放弃这个连接，
+        # 以免 shutdown() 要等到有工作线程空闲才能返回
+        while not self.idle_workers.acquire(timeout=0.5):
+            if self.stopping:
+                self.shutdown_request(request)
+                return
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.idle_workers.release()
+
+    def shutdown(self):
+        self.stopping = True
+        super().shutdown()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+# asyncio 前端中请求正文的长度上限，单位为字节
+MAX_REQUEST_BODY = 64 * 1024 * 1024
+
+# asyncio 前端使用的请求处理器设置：以 HTTP/1.1 响应并保持连接，100 Continue 由前端在读取正文前发送
+class KeepAliveMixin:
+    protocol_version = 'HTTP/1.1'
+
+    def handle_expect_100(self):
+        return True
+
+# 请求处理器的输出：在工作线程中写入时积累到 64 KB 再交给事件循环发送并等待发送完成（流式响应据此获得背压），
+# 其余部分在处理结束后由事件循环发送；在事件循环线程中直接处理的请求只积累不发送
+class LoopWriter:
+    buffer_size = 65536
+
+    def __init__(self, loop, writer, inline=False):
+        self.loop = loop
+        self.writer = writer
+        self.inline = inline
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if not self.inline and len(self.buffer) >= self.buffer_size:
+            asyncio.run_coroutine_threadsafe(self.send(self.take()), self.loop).result()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    # 取出尚未发送的数据
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+# asyncio 前端：事件循环读取请求并保持 HTTP/1.1 持久连接，空闲连接只占用一个协程。
+# 同一连接上的请求（包括流水线请求）按顺序读取、处理与响应；每个请求交给与线程模式相同的请求处理器，
+# 在有界线程池中执行其中阻塞的 sqlite3 调用，静态资源直接在事件循环中处理。
+# 提供与 socketserver 相同的 serve_forever、shutdown、server_close 与 server_address
+class AsyncioServer:
+    def __init__(self, server_address, RequestHandlerClass, workers=8, backlog=64, keep_alive_timeout=60):
+        self.handler_class = type(RequestHandlerClass.__name__, (KeepAliveMixin, RequestHandlerClass), {})
+        self.workers = workers
+        self.keep_alive_timeout = keep_alive_timeout
+        self.socket = socket.create_server(server_address, backlog=backlog)
+        self.server_address = self.socket.getsockname()[:2]
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+        self.loop = None
+        self.stopped = None
+        self.connections = set()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        # 同时在线程池中处理的请求数，其余请求在事件循环中等待
+        self.slots = asyncio.Semaphore(self.workers)
+        server = await asyncio.start_server(self.handle_connection, sock=self.socket, limit=65536)
+        async with server:
+            await self.stopped.wait()
+            server.close()
+            for task in list(self.connections):
+                task.cancel()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+
+    # 从其他线程停止服务器
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=True)
+
+    # 处理一个连接上的全部请求
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        client_address = writer.get_extra_info('peername')
+        try:
+            while True:
+                # 读取请求头，空闲超时后关闭连接
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_timeout)
+                except asyncio.LimitOverrunError:
+                    writer.write(simple_response(431, '请求头过长'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in lines[1:]:
+                    name, separator, value = line.partition(':')
+                    if separator:
+                        headers[name.strip().lower()] = value.strip()
+                # 只接受以 Content-Length 给出长度的正文，保证能准确找到下一个请求的开头
+                if 'transfer-encoding' in headers:
+                    writer.write(simple_response(411, '请使用 Content-Length 发送请求正文'))
+                    break
+                try:
+                    length = int(headers.get('content-length', '0'))
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    writer.write(simple_response(400, '无效的 Content-Length'))
+                    break
+                if length > MAX_REQUEST_BODY:
+                    writer.write(simple_response(413, '请求正文过长'))
+                    break
+                if headers.get('expect', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                body = await asyncio.wait_for(reader.readexactly(length), self.keep_alive_timeout) if length else b''
+
+                request_line = lines[0].split()
+                inline = len(request_line) >= 2 and request_line[0] == 'GET' and urlparse(request_line[1]).path in STATIC_ASSETS
+                output = LoopWriter(self.loop, writer, inline)
+                if inline:
+                    handler = self.run_handler(head + body, client_address, output)
+                else:
+                    async with self.slots:
+                        handler = await self.loop.run_in_executor(self.executor, self.run_handler, head + body, client_address, output)
+                writer.write(output.take())
+                await writer.drain()
+                if handler.close_connection:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f'处理连接时出错：{e}')
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    # 用请求处理器处理一个完整的请求（在工作线程中执行）
+    def run_handler(self, raw_request, client_address, output):
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.request = None
+        handler.client_address = client_address
+        handler.rfile = io.BytesIO(raw_request)
+        handler.wfile = output
+        handler.close_connection = True
+        handler.handle_one_request()
+        return handler
+
+# 前端直接返回的简短错误响应，发送后关闭连接
+def simple_response(code, message):
+    body = message.encode('utf-8')
+    return f'HTTP/1.1 {code} {http.HTTPStatus(code).phrase}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+
 class car_sales_system(http.server.BaseHTTPRequestHandler):
     max_cache_time = 86400  # 最大缓存时间，单位为秒
+    gzip_min_size = 1024  # 动态响应启用 gzip 压缩的最小长度，单位为字节
+    gzip_level = 6  # 动态响应的 gzip 压缩级别
+    console_max_rows = 1000  # 控制台单条指令最多返回的行数
+    console_timeout = 5.0  # 控制台单条指令的执行时间上限，单位为秒
+
+    # 解析请求行与请求头，成功后开始计时
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.status_code = None
+        self.request_start = time.perf_counter()
+        metrics.request_started()
+        sync_caches()
+        if sql_tracer.enabled:
+            sql_tracer.begin(metrics_route(self.path))
+        return True
+
+    # 处理一个请求，结束后记录请求数与耗时
+    def handle_one_request(self):
+        self.request_start = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_start is not None:
+                if sql_tracer.enabled:
+                    sql_tracer.end()
+                method = self.command if self.command in ('GET', 'POST') else 'other'
+                metrics.request_finished(method, metrics_route(self.path), self.status_code or 0, time.perf_counter() - self.request_start)
+
+    # 发送状态行，同时记下状态码供指标使用
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
 
     # 当客户端发送 GET 请求时
     def do_GET(self):
@@ -22,87 +1849,44 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
             if self.path.startswith('/./'):
                 self.send_response(301)
                 self.send_header('Location', self.path[2:])
+                self.send_header('Content-Length', '0')
                 self.end_headers()
-            # 当访问根目录或 index.html 时，返回首页
-            elif self.path == '/' or self.path == '/index.html' or self.path.startswith('/?') or self.path.startswith('/index.html'):
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
-                self.end_headers()
-                # 返回页面内容
-                self.wfile.write(self.generate_index_html())
-            elif self.path == '/test_page.html':
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
-                self.end_headers()
-                # 返回页面内容
-                self.wfile.write(self.generate_test_page_html())
-            # 访问登陆页面
-            elif self.path == '/login.html' or self.path.startswith('/login.html'):
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
-                self.end_headers()
-                # 返回页面内容
-                self.wfile.write(self.generate_login_html())
+            # 预先生成的静态资源
+            elif urlparse(self.path).path in STATIC_ASSETS:
+                self.send_static(STATIC_ASSETS[urlparse(self.path).path])
             # 访问车辆库存管理页面
-            elif self.path == '/inventory_management.html' or self.path.startswith('/inventory_management.html'):
-                # 获取用户名和密码
-                query_string = urlparse(self.path).query
-                query_params = parse_qs(query_string)
-                username = query_params.get('username', [''])[0]
-                password = query_params.get('password', [''])[0]
-                role = self.check_login(username, password)
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.send_header('Cache-Control', f'public, max-age=5')
-                self.end_headers()
-                # 如果登录成功，则返回页面内容否则报错并指引用户返回登录页面
+            elif urlparse(self.path).path == '/inventory_management.html':
+                # 从会话中获取角色，未登录时报错并指引用户返回登录页面
+                role = self.authenticate()
                 if role:
-                    self.wfile.write(self.generate_inventory_management_html(username, password, role))
-                else:
-                    self.wfile.write(self.generate_error_html(300, '用户名或密码有误。'))
+                    page = self.generate_inventory_management_html(role)
+                    self.send_body(200, 'text/html; charset=utf-8', page, {'Cache-Control': 'private, max-age=5'})
             # 访问车辆管理页面
-            elif self.path.startswith('/vehicles_management.html'):
-                # 获取用户名和密码
-                query_string = urlparse(self.path).query
-                query_params = parse_qs(query_string)
-                username = query_params.get('username', [''])[0]
-                password = query_params.get('password', [''])[0]
-                role = self.check_login(username, password)
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.end_headers()
-                # 如果登录成功，则返回车辆管理页面否则报错并指引用户返回登录页面
+            elif urlparse(self.path).path == '/vehicles_management.html':
+                # 从会话中获取角色，未登录时报错并指引用户返回登录页面
+                role = self.authenticate()
                 if role:
-                    self.wfile.write(self.generate_vehicles_management_html(username, password, role))
-                else:
-                    self.wfile.write(self.generate_error_html(300, '用户名或密码有误。'))
-            # 当访问 car_sales_system.css 时，返回样式表
-            elif self.path == '/car_sales_system.css':
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('X-Content-Type-Options', 'nosniff')
-                self.send_header('Content-type', 'text/css')
-                self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
-                self.end_headers()
-                # 返回样式表内容
-                self.wfile.write(self.generate_css())
-            # 当访问 favicon.ico 时，返回图标
-            elif self.path == '/favicon.ico':
-                # 返回请求头
-                self.send_response(200)
-                self.send_header('Content-type', 'image/svg+xml')
-                self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
+                    page = self.generate_vehicles_management_html(role, parse_qs(urlparse(self.path).query))
+                    self.send_body(200, 'text/html; charset=utf-8', page)
+            # 退出登录
+            elif urlparse(self.path).path == '/logout':
+                session_store.revoke(self.session_token())
+                self.send_response(303)
+                self.send_header('Location', '/login.html')
+                self.send_header('Set-Cookie', 'session=; Path=/; HttpOnly; SameSite=Strict; Max-Age=0')
+                self.send_header('Content-Length', '0')
                 self.end_headers()
-                # 返回图标内容
-                self.wfile.write(self.generate_favicon())
+            # 导出财务信息
+            elif urlparse(self.path).path == '/export/financials':
+                if self.authenticate(html=False):
+                    self.export_financials(parse_qs(urlparse(self.path).query))
+            # JSON 数据接口
+            elif self.path.startswith('/api/'):
+                if self.authenticate(html=False):
+                    self.handle_api()
+            # 运行指标
+            elif urlparse(self.path).path == '/metrics':
+                self.send_body(200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode('utf-8'), {'Cache-Control': 'no-store'})
             # 404
             else:
                 self.send_msg_error(404, "未找到该资源。")
@@ -116,63 +1900,246 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length).decode('utf-8')
                 data = json.loads(post_data)
-                brand = data.get('brand')
-                model = data.get('model')
-                manufacturer = data.get('manufacturer')
-                operation = data.get('operation')
-                quantity = int(data.get('quantity'))
-                customername = data.get('customername')
-
-                if (quantity < 1):
-                    self.send_msg_error(400, "数量必须大于0！", "", False)
-                
-                self.add_data(brand, model, manufacturer, operation, quantity, customername)
+                record, error = parse_record(data)
+                if error:
+                    self.send_msg_error(400, error, "", False)
+                    return
+
+                self.add_data(*record)
+            elif self.path == '/login':
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length).decode('utf-8')
+                data = json.loads(post_data)
+                username = str(data.get('username', ''))
+                password = str(data.get('password', ''))
+                role = self.check_login(username, password)
+                if not role:
+                    self.send_msg_error(400, '用户名或密码有误。', "", False)
+                    return
+                token = session_store.create(username, role, operator_fingerprint(username, password, role))
+                self.send_body(200, 'text/plain; charset=utf-8', 'success'.encode('utf-8'), {'Set-Cookie': session_cookie(token)})
+            elif self.path == '/add_messages':
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length).decode('utf-8')
+                data = json.loads(post_data)
+                self.add_batch(data)
             elif self.path == '/console':
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length).decode('utf-8')
                 data = json.loads(post_data)
-                message = data.get('message')
+                message = data.get('message') if isinstance(data, dict) else None
+                if not isinstance(message, str) or not message.strip():
+                    self.send_msg_error(400, '缺少指令', "", False)
+                    return
+                try:
+                    max_rows = int(data.get('limit') or self.console_max_rows)
+                    timeout = float(data.get('timeout') or self.console_timeout)
+                except (TypeError, ValueError):
+                    self.send_msg_error(400, 'limit 应为整数，timeout 应为秒数', "", False)
+                    return
+                # 请求可以降低行数与时间上限，但不能超过服务器的设置；不是正数时使用服务器的设置
+                max_rows = min(max_rows, self.console_max_rows) if max_rows > 0 else self.console_max_rows
+                timeout = min(timeout, self.console_timeout) if timeout > 0 else self.console_timeout
 
-                # 处理指令
+                # 处理指令（任何指令都可能修改厂商、车辆与客户，执行后清空名称缓存）
+                writer = self.start_body(200, 'text/plain; charset=utf-8')
                 if message == 'reset-database':
-                    result = reset_database()
+                    writer.write(reset_database().encode('utf-8'))
+                elif message == 'rebuild-rollups':
+                    writer.write(rebuild_sales_rollups().encode('utf-8'))
+                elif message == 'pool-stats':
+                    writer.write(json.dumps(database_pool.get_stats()).encode('utf-8'))
                 else:
-                    result = self.handle_sql_command(message)
-
-                # 返回结果给客户端
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(result.encode('utf-8'))
+                    if not self.handle_sql_command(writer, message, max_rows, timeout, bool(data.get('explain'))):
+                        return
+                # 操作员信息可能被修改，撤销与数据库不一致的会话
+                if message != 'reset-database' and 'operators' in message.lower():
+                    session_store.revalidate()
+                invalidate_caches()
+
+                # 结束发送给客户端的结果
+                writer.close()
             else:
                 self.send_msg_error(404, "未找到该资源。", "", False)
         except Exception as e:
             self.send_msg_error(500, f"服务器出错。<br>{e}", "", False)
 
-    # 处理 SQL 命令
-    def handle_sql_command(self, command):
+    # 发送静态资源，支持 gzip 协商与条件请求
+    def send_static(self, asset):
+        use_gzip = asset.gzip_content is not None and accepts_encoding(self.headers.get('Accept-Encoding', ''), 'gzip')
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        not_modified = asset.not_modified(self.headers, etag)
+        self.send_response(304 if not_modified else 200)
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('X-Content-Type-Options', 'nosniff')
+        self.send_header('Cache-Control', f'public, max-age={self.max_cache_time}')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        self.send_header('Vary', 'Accept-Encoding')
+        if not_modified:
+            self.end_headers()
+            return
+        content = asset.gzip_content if use_gzip else asset.content
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # 处理 JSON 数据接口：ETag 由数据库变更计数生成，数据未变化时直接返回 304 而不查询数据表
+    def handle_api(self):
+        url = urlparse(self.path)
+        query_params = parse_qs(url.query)
+        producer = API_ROUTES.get(url.path)
+        if producer is None:
+            self.send_json(404, {'error': '未找到该资源。'})
+            return
+        version = data_version.get()
+        # 库存接口中的今日、本月销量随日期变化
+        if url.path == '/api/inventory':
+            version += '.' + time.strftime('%Y-%m-%d', time.gmtime())
+        elif url.path == '/api/reports':
+            report, error = parse_report_query(query_params)
+            if error:
+                self.send_json(400, {'error': error})
+                return
+            # 日常的买入与卖出只写入当天的记录，同时改变当前库存与截止日期以后的变动，截止日期早于今天的统计结果不会因此变化；
+            # 这样的统计只在历史版本变化（写入今天以前的财务信息、控制台修改数据）或重新打开数据库后重新统计
+            if report['end'].isoformat() < time.strftime('%Y-%m-%d', time.gmtime()):
+                conn, cursor = connect_to_database()
+                try:
+                    history = history_version(cursor)
+                finally:
+                    conn.close()
+                if history is not None:
+                    version = f'{data_version.token}.{data_version.epoch}.h{history}'
+        # 接受 gzip 的请求可能得到压缩后的表示，两种表示使用不同的 ETag，缓存不会以一种表示重新验证另一种
+        encoding = '-gzip' if accepts_encoding(self.headers.get('Accept-Encoding', ''), 'gzip') else ''
+        etag = f'"{url.path[5:]}-{version}-{zlib.crc32(url.query.encode("utf-8")):x}{encoding}"'
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        if url.path in CACHED_API_ROUTES:
+            body = fragment_cache.get(f'{url.path}?{url.query}', version, lambda: self.render_api(producer, query_params))
+        else:
+            body = self.render_api(producer, query_params)
+        self.send_body(200, 'application/json; charset=utf-8', body, {'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    # 生成接口的 JSON 正文（已编码）
+    def render_api(self, producer, query_params):
+        conn, cursor = connect_to_database()
+        try:
+            data = producer(cursor, query_params)
+        finally:
+            conn.close()
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    # 流式导出财务信息：逐行读取游标并以分块传输发送，内存占用与行数无关
+    def export_financials(self, query_params):
+        file_format = query_params.get('format', ['csv'])[0]
+        if file_format not in ('csv', 'ndjson'):
+            self.send_msg_error(400, '无效的导出格式')
+            return
+        filters = {key: query_params.get(key, [''])[0] for key in EXPORT_FILTERS}
+        content_type = 'text/csv; charset=utf-8' if file_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+        conn, cursor = connect_to_database()
+        try:
+            rows = query_financials(cursor, **filters)
+            writer = self.start_body(200, content_type, {'Content-Disposition': f'attachment; filename="financials.{file_format}"'})
+            for data in encode_financials(rows, file_format):
+                writer.write(data)
+            writer.close()
+        finally:
+            conn.close()
+
+    # 发送 JSON 响应
+    def send_json(self, code, data, headers={}):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_body(code, 'application/json; charset=utf-8', body, headers)
+
+    # 开始发送动态生成的响应，返回正文写入器
+    def start_body(self, code, content_type, headers={}):
+        return ResponseWriter(self, code, content_type, headers)
+
+    # 发送动态生成的完整响应
+    def send_body(self, code, content_type, body, headers={}):
+        writer = self.start_body(code, content_type, headers)
+        writer.write(body)
+        writer.close()
+
+    # 处理 SQL 命令：结果边读取边写入响应，超过行数上限时停止读取，超过时间上限时由进度回调中断执行。
+    # 客户端断开连接时回滚并返回 False
+    def handle_sql_command(self, writer, command, max_rows, timeout, explain=False):
         conn, cursor = connect_to_database()
+        start = time.perf_counter()
+        progress = {'steps': 0, 'timed_out': False}
+
+        # 每执行 CONSOLE_PROGRESS_STEPS 条虚拟机指令回调一次，返回真值时 SQLite 中断执行
+        def check_progress():
+            progress['steps'] += CONSOLE_PROGRESS_STEPS
+            progress['timed_out'] = time.perf_counter() - start > timeout
+            return progress['timed_out']
+
+        conn.set_progress_handler(check_progress, CONSOLE_PROGRESS_STEPS)
+        changes = conn.total_changes
+        rows = 0
+        in_table = False
         try:
-            cursor.execute(command)
+            if explain:
+                writer.write(explain_query_plan(cursor, command).encode('utf-8'))
+            with metrics.time_query('console'):
+                cursor.execute(command)
+            writer.write('运行结果：<br><table>'.encode('utf-8'))
+            in_table = True
+            if cursor.description:
+                writer.write(('<thead><tr>' + ''.join(f'<th>{html.escape(column[0])}</th>' for column in cursor.description) + '</tr></thead>').encode('utf-8'))
+            writer.write(b'<tbody>')
+            while rows < max_rows:
+                batch = cursor.fetchmany(min(CONSOLE_FETCH_SIZE, max_rows - rows))
+                if not batch:
+                    break
+                rows += len(batch)
+                writer.write(''.join('<tr>' + ''.join(f'<td>{html.escape(str(j))}</td>' for j in i) + '</tr>' for i in batch).encode('utf-8'))
+            truncated = rows == max_rows and cursor.fetchone() is not None
+            writer.write(b'</tbody></table>')
+            in_table = False
+            # 控制台可以直接修改库存等数据而不经过财务信息，修改过数据时令已结束日期范围的进销存统计失效
+            if conn.total_changes != changes or cursor.description is None:
+                bump_history_version(conn)
             conn.commit()
-            raw = cursor.fetchall()
-            result = '运行结果：<br><table><tbody>'
-            for i in raw:
-                result += '<tr>'
-                for j in i:
-                    result += f'<td>{j}</td>'
-                result += '</tr>'
-            result += '</tbody></table>'
+            if cursor.description:
+                summary = f'返回 {rows} 行'
+                if truncated:
+                    summary += f'（已达到上限 {max_rows} 行，其余结果未返回）'
+            else:
+                summary = f'影响 {max(cursor.rowcount, 0)} 行'
+            summary += f'，用时 {(time.perf_counter() - start) * 1000:.1f} ms，{describe_progress(progress["steps"])}。'
+            writer.write(f'<p>{summary}</p>'.encode('utf-8'))
+        except OSError:
+            conn.rollback()
+            print('客户端已断开连接，SQL 指令已中止并回滚。')
+            return False
         except Exception as e:
             conn.rollback()  # 回滚事务
-            result = f'数据库操作失败: {str(e)}<br>操作已回滚。'
+            if in_table:
+                writer.write(b'</tbody></table>')
+            if progress['timed_out']:
+                result = f'执行超过 {timeout:g} 秒，已中断，已返回 {rows} 行，{describe_progress(progress["steps"])}。<br>操作已回滚。'
+            else:
+                result = f'数据库操作失败: {html.escape(str(e))}<br>操作已回滚。'
             print(result)
+            writer.write(result.encode('utf-8'))
         finally:
+            conn.set_progress_handler(None, 0)
             conn.close()
-        return result
+        return True
 
     # 生成数据库连接页面
-    def generate_index_html(self):
+    @staticmethod
+    def generate_index_html():
         return '''<!DOCTYPE html>
 <html lang="zh-CN">
 
@@ -232,7 +2199,8 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
 </html>'''.encode('utf-8')
 
     # 生成汽车销售登陆系统页面
-    def generate_login_html(self):
+    @staticmethod
+    def generate_login_html():
         return '''<!DOCTYPE html>
 <html lang="zh-CN">
 
@@ -271,8 +2239,26 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                 // 获取表单元素
                 const username = document.getElementById('username').value;
                 const password = document.getElementById('password').value;
-                //跳转到车辆管理页面
-                window.location.href = "vehicles_management.html?username=" + username + "&password=" + password;
+                // 登录成功后跳转到车辆管理页面
+                fetch('/login', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ username: username, password: password })
+                })
+                    .then(response => response.text())
+                    .then(data => {
+                        if (data != 'success') {
+                            alert('登录失败：' + data);
+                        } else {
+                            window.location.href = "vehicles_management.html";
+                        }
+                    })
+                    .catch((error) => {
+                        console.error('Error:', error);
+                        alert(error);
+                    });
             }
         </script>
     </div>
@@ -281,12 +2267,19 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
 </html>'''.encode('utf-8')
 
     # 生成车辆管理页面
-    def generate_vehicles_management_html(self, username, password, role):
+    def generate_vehicles_management_html(self, role, query_params={}):
         control = ' style="display:none"'
         test_page_link = ''
         if role == 'admin':
             control = ''
             test_page_link = '<a href="test_page.html">管理员测试页面</a>'
+        # 交易信息的筛选条件与分页
+        filters = {key: query_params.get(key, [''])[0] for key in ('brand', 'customer', 'type')}
+        page_size = parse_page_size(query_params.get('size', [''])[0])
+        ledger = self.get_ledger(filters, query_params.get('before', [''])[0], query_params.get('after', [''])[0], page_size)
+        type_options = ''.join(
+            f'<option value="{value}"{" selected" if filters["type"] == value else ""}>{label}</option>'
+            for value, label in (('', '全部'), ('buy', '买入'), ('sell', '卖出')))
         return f'''<!DOCTYPE html>
 <html lang="zh-CN">
 
@@ -301,8 +2294,8 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
     <div class="container" style="max-width: 800px;">
         <fieldset>
             <legend>汽车管理系统</legend>
-            <a href="inventory_management.html?username={username}&password={password}">库存信息</a>
-            <a href="login.html">退出登录</a>
+            <a href="inventory_management.html">库存信息</a>
+            <a href="logout">退出登录</a>
             {test_page_link}
         </fieldset>
         <fieldset{control}>
@@ -310,22 +2303,19 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
             <label for="brand">车辆品牌：</label>
             <input type="text" list="brand_list" id="brand" required>
             <datalist id="brand_list">
-                <!-- 默认选项 -->
-                {self.get_options('brand', 'vehicles')}
+                <!-- 候选项按输入前缀从 /api/suggest 加载 -->
             </datalist>
             <br>
             <label for="model">车辆型号：</label>
             <input type="text" list="model_list" id="model" required>
             <datalist id="model_list">
-                <!-- 默认选项 -->
-                {self.get_options('model', 'vehicles')}
+                <!-- 候选项按输入前缀从 /api/suggest 加载 -->
             </datalist>
             <br>
             <label for="manufacturer">车辆制造商：</label>
             <input type="text" list="manufacturer_list" id="manufacturer" required>
             <datalist id="manufacturer_list">
-                <!-- 默认选项 -->
-                {self.get_options('name', 'manufacturers')}
+                <!-- 候选项按输入前缀从 /api/suggest 加载 -->
             </datalist>
             <br>
             <label for="operation">操作：</label>
@@ -338,36 +2328,55 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
             <label for="customername">客户信息：</label>
             <input type="text" list="customername_list" id="customername" required>
             <datalist id="customername_list">
-                <!-- 默认选项 -->
-                {self.get_options('name', 'customers')}
+                <!-- 候选项按输入前缀从 /api/suggest 加载 -->
             </datalist>
             <br>
             <button id="submit">提交</button>
         </fieldset>
         <fieldset>
             <legend>交易信息</legend>
-            <table>
-                <thead>
-                    <tr>
-                        <th>车辆品牌</th>
-                        <th>车辆型号</th>
-                        <th>车辆制造商</th>
-                        <th>操作</th>
-                        <th>数量</th>
-                        <th>客户信息</th>
-                        <th>日期</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    <!-- 汽车数据将在这里动态生成 -->
-                    {self.get_vehicle_transactions()}
-                </tbody>
-            </table>
+            <form action="vehicles_management.html" method="get">
+                <input type="hidden" name="size" value="{page_size}">
+                <label for="filter_brand">车辆品牌：</label>
+                <input type="text" id="filter_brand" name="brand" value="{html.escape(filters['brand'])}">
+                <label for="filter_customer">客户信息：</label>
+                <input type="text" id="filter_customer" name="customer" value="{html.escape(filters['customer'])}">
+                <label for="filter_type">操作：</label>
+                <select id="filter_type" name="type">{type_options}</select>
+                <button type="submit">筛选</button>
+            </form>
+            '''.encode('utf-8') + ledger + f'''
         </fieldset>
     </div>
 
     <script>
         document.addEventListener('DOMContentLoaded', () => {{
+            // 按输入前缀加载候选项
+            [['brand', 'brand'], ['model', 'model'], ['manufacturer', 'manufacturer'], ['customername', 'customer']].forEach(([id, field]) => {{
+                const input = document.getElementById(id);
+                const list = document.getElementById(id + '_list');
+                let timer = null;
+                const load = () => {{
+                    fetch('/api/suggest?' + new URLSearchParams({{ field: field, prefix: input.value, limit: 20 }}))
+                        .then(response => response.json())
+                        .then(values => {{
+                            list.replaceChildren(...values.map(value => {{
+                                const option = document.createElement('option');
+                                option.value = value;
+                                return option;
+                            }}));
+                        }})
+                        .catch((error) => {{
+                            console.error('Error:', error);
+                        }});
+                }};
+                input.addEventListener('focus', load, {{ once: true }});
+                input.addEventListener('input', () => {{
+                    clearTimeout(timer);
+                    timer = setTimeout(load, 150);
+                }});
+            }});
+
             // 添加汽车
             document.querySelector('#submit').addEventListener('click', (e) => {{
                 e.preventDefault();
@@ -454,7 +2463,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
 </html>'''.encode('utf-8')
 
     # 生成车辆库存管理页面
-    def generate_inventory_management_html(self, username, password, role):
+    def generate_inventory_management_html(self, role):
         test_page_link = ''
         if role == 'admin':
             test_page_link = '<a href="test_page.html">管理员测试页面</a>'
@@ -472,8 +2481,8 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
     <div class="container" style="max-width: 800px;">
         <fieldset>
             <legend>汽车库存管理系统</legend>
-            <a href="vehicles_management.html?username={username}&password={password}">汽车管理系统</a>
-            <a href="login.html">退出登录</a>
+            <a href="vehicles_management.html">汽车管理系统</a>
+            <a href="logout">退出登录</a>
             {test_page_link}
         </fieldset>
         <fieldset>
@@ -490,7 +2499,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                 </thead>
                 <tbody>
                     <!-- 汽车数据将在这里动态生成 -->
-                    {self.get_vehicle_inventory()}
+                    '''.encode('utf-8') + self.get_vehicle_inventory() + '''
                 </tbody>
             </table>
         </fieldset>
@@ -500,7 +2509,8 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
 </html>'''.encode('utf-8')
 
     # 生成管理员测试页面
-    def generate_test_page_html(self):
+    @staticmethod
+    def generate_test_page_html():
         return '''<!DOCTYPE html>
 <html lang="zh-CN">
 
@@ -535,7 +2545,10 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     </option>
                     <option value="select * from vehicles"></option>
                     <option value="reset-database"></option>
+                    <option value="rebuild-rollups"></option>
+                    <option value="pool-stats"></option>
                 </datalist>
+                <label><input type="checkbox" id="explainInput"> 显示查询计划</label>
                 <button type="submit">发送</button>
                 <a href="login.html">返回</a>
             </fieldset>
@@ -548,6 +2561,12 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     <li>
                         <code>reset-database</code>：重置整个数据库并初始化数据。
                     </li>
+                    <li>
+                        <code>rebuild-rollups</code>：根据财务信息重建销售日记录与销售月记录。
+                    </li>
+                    <li>
+                        <code>pool-stats</code>：查看数据库连接池的打开、复用与等待次数。
+                    </li>
                 </ul>
 
                 <h2>示例</h2>
@@ -593,7 +2612,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     <tr>
                         <td>manufacturer_id</td>
                         <td>整数型</td>
-                        <td>外键关联 manufacturers 表的 id</td>
+                        <td>外键关联 manufacturers 表的 id；与 brand、model 组合唯一</td>
                     </tr>
                 </table>
 
@@ -612,7 +2631,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     <tr>
                         <td>name</td>
                         <td>文本型</td>
-                        <td>不允许为空</td>
+                        <td>不允许为空且唯一</td>
                     </tr>
                 </table>
 
@@ -660,7 +2679,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     <tr>
                         <td>name</td>
                         <td>文本型</td>
-                        <td>不允许为空</td>
+                        <td>不允许为空且唯一</td>
                     </tr>
                     <tr>
                         <td>contact_info</td>
@@ -723,7 +2742,7 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                     <tr>
                         <td>vehicle_id</td>
                         <td>整数型</td>
-                        <td>外键关联 vehicles 表的 id</td>
+                        <td>外键关联 vehicles 表的 id；唯一</td>
                     </tr>
                     <tr>
                         <td>quantity</td>
@@ -744,11 +2763,22 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ message: messageInput })
+                body: JSON.stringify({ message: messageInput, explain: document.getElementById('explainInput').checked })
             })
-                .then(response => response.text())
-                .then(data => {
-                    document.querySelector('.content').innerHTML = data;
+                .then(async response => {
+                    // 逐段读取结果，边接收边显示
+                    const content = document.querySelector('.content');
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let data = '';
+                    for (;;) {
+                        const { done, value } = await reader.read();
+                        if (done) {
+                            break;
+                        }
+                        data += decoder.decode(value, { stream: true });
+                        content.innerHTML = data;
+                    }
                 })
                 .catch((error) => {
                     console.error('Error:', error);
@@ -760,11 +2790,13 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
 </html>'''.encode('utf-8')
 
     # 生成图标
-    def generate_favicon(self):
+    @staticmethod
+    def generate_favicon():
         return '''<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50"><circle cx="25" cy="25" r="20" fill="green" /></svg>'''.encode('utf-8')
 
     # 生成样式表
-    def generate_css(self):
+    @staticmethod
+    def generate_css():
         return f'''body{{font-family:Arial,sans-serif;background-color:#f4f4f4;margin:0;padding-top:20px;color:#333}}.hide{{display:none}}.container{{box-sizing:border-box;overflow:hidden;width:100%;max-width:600px;margin:0 auto;padding:20px;background-color:#fff;border:1px solid #ccc;box-shadow:2px 2px 5px rgba(0,0,0,0.1);border-radius:5px}}fieldset{{border:1px solid #ddd;padding:10px;margin-bottom:5px}}legend{{font-weight:bold;padding:0 10px}}label{{display:block;margin-bottom:5px}}input[type="text"],input[type="number"],input[type="password"],textarea,iframe,.content{{box-sizing:border-box;max-width:100%;width:100%;padding:8px;margin-bottom:10px;border:1px solid #ddd;border-radius:3px}}a,a:visited,button{{align-items:center;text-decoration:none;padding:8px 15px;margin-right:5px;background-color:#007BFF;color:#fff;border:none;border-radius:3px;cursor:pointer}}a:hover,a:visited:hover,button:hover{{background-color:#0056b3}}button:active{{background-color:#0067b8}}@media (max-width:600px){{.container{{width:100%;height:100%;border:none;border-radius:0;box-shadow:none}}}}table{{width:100%}}th,td{{border:1px solid #ddd}}th{{background-color:#f2f2f2}}'''.encode('utf-8')
 
     # 生成报错误页面
@@ -773,224 +2805,165 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
             errorMsg = f'错误代码：{errorCode}<br>Error code: {errorCode}'
         return f'''<!DOCTYPE html><html lang="zh-Hans"><head><meta charset="UTF-8"><title>错误：{errorCode}</title><link type="text/css" rel="stylesheet" href="/car_sales_system.css"><meta name="viewport" content="width=192, initial-scale=1.0"></head><body><div class="container"><fieldset><legend>错误：{errorCode}</legend><div class="content">{errorMsg}</div>{buttons}</fieldset></div><div class="loading-bar"><div class="progress"></div></div></body></html>'''.encode('utf-8')
 
-    # 获取车辆交易信息
-    def get_vehicle_transactions(self):
-        conn, cursor = connect_to_database()
-        cursor.execute('''
-            SELECT t1.brand, t1.model, t3.name, t0.transaction_type, t0.amount, t2.name, t0.date 
-            FROM financials t0, vehicles t1, customers t2, manufacturers t3
-            WHERE t0.vehicle_id = t1.id AND t0.customer_id = t2.id AND t1.manufacturer_id = t3.id
-        ''')
-        raw = cursor.fetchall()
-        conn.close()
-        financials = ''
-        for i in raw:
-            financials += '<tr>'
-            for j in i:
-                financials += f'<td>{j}</td>'
-            financials += '</tr>'
-        return financials
+    # 获取交易信息表格与翻页链接（已编码），同一筛选条件与页码在数据未变化时直接使用片段缓存
+    def get_ledger(self, filters, before, after, page_size):
+        name = 'ledger?' + urlencode(dict(filters, before=before, after=after, size=page_size))
+        return fragment_cache.get(name, data_version.get(), lambda: self.render_ledger(filters, before, after, page_size))
+
+    # 生成交易信息表格与翻页链接
+    def render_ledger(self, filters, before, after, page_size):
+        transactions, prev_cursor, next_cursor = self.get_vehicle_transactions(
+            filters['brand'], filters['customer'], filters['type'], before, after, page_size)
+        page_query = dict(filters, size=page_size)
+        pagination = ''
+        if prev_cursor:
+            pagination += f'<a href="vehicles_management.html?{html.escape(urlencode(dict(page_query, after=prev_cursor)))}">上一页</a>'
+        if next_cursor:
+            pagination += f'<a href="vehicles_management.html?{html.escape(urlencode(dict(page_query, before=next_cursor)))}">下一页</a>'
+        return f'''<table>
+                <thead>
+                    <tr>
+                        <th>车辆品牌</th>
+                        <th>车辆型号</th>
+                        <th>车辆制造商</th>
+                        <th>操作</th>
+                        <th>数量</th>
+                        <th>客户信息</th>
+                        <th>日期</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    <!-- 汽车数据将在这里动态生成 -->
+                    {transactions}
+                </tbody>
+            </table>
+            {pagination}'''.encode('utf-8')
 
-    # 获取车辆库存信息
+    # 获取车辆交易信息（一页），返回 (表格行, 上一页游标, 下一页游标)
+    def get_vehicle_transactions(self, brand='', customer='', transaction_type='', before='', after='', page_size=50):
+        conn, cursor = connect_to_database()
+        try:
+            rows, prev_cursor, next_cursor = query_transactions(cursor, brand, customer, transaction_type, before, after, page_size)
+        finally:
+            conn.close()
+        financials = []
+        for i in rows:
+            financials.append('<tr>')
+            for j in i[1:]:
+                financials.append(f'<td>{j}</td>')
+            financials.append('</tr>')
+        return ''.join(financials), prev_cursor, next_cursor
+
+    # 获取车辆库存信息（已编码的表格行），数据未变化时直接使用片段缓存
     def get_vehicle_inventory(self):
+        # 今日、本月的卖出数量随日期变化
+        version = data_version.get() + '.' + time.strftime('%Y-%m-%d', time.gmtime())
+        return fragment_cache.get('inventory', version, self.render_vehicle_inventory)
+
+    # 生成车辆库存表格的各行（已编码）
+    def render_vehicle_inventory(self):
         conn, cursor = connect_to_database()
-        cursor.execute('''
-            select brand, model, quantity, (SELECT SUM(amount) FROM financials WHERE transaction_type = '卖出' AND date = date('now') AND financials.vehicle_id = vehicles.id), (SELECT SUM(amount) FROM financials WHERE transaction_type = '卖出' AND strftime('%Y-%m', date) = strftime('%Y-%m', 'now') AND financials.vehicle_id = vehicles.id)
-            from inventory, vehicles
-            where vehicles.id = inventory.vehicle_id
-        ''')
-        raw = cursor.fetchall()
-        conn.close()
-        inventory = ''
+        try:
+            raw = query_inventory(cursor)
+        finally:
+            conn.close()
+        inventory = []
         for i in raw:
-            inventory += '<tr>'
+            inventory.append('<tr>')
             for j in i:
                 if j == None:
                     j = '<i>无</i>'
-                inventory += f'<td>{j}</td>'
-            inventory += '</tr>'
-        return inventory
-
-    # 获取单个属性的所有数据
-    def get_single_attribute_data(self, attribute, table_name):
-        conn, cursor = connect_to_database()
-        cursor.execute(f'SELECT DISTINCT {attribute} FROM {table_name}')
-        data = cursor.fetchall()
-        conn.close()
-        return data
-
-    # 获取单个属性的所有数据
-    def get_options(self, attribute, table_name):
-        raw = self.get_single_attribute_data(attribute, table_name)
-        data = ''
-        for i in raw:
-            data += f'<option value="{i[0]}"></option>'
-        return data
-
-    # 是否存在某车辆
-    def vehicle_exist(self, brand, model, manufacturer):
-        conn, cursor = connect_to_database()
-        cursor.execute('''
-            SELECT EXISTS(SELECT 1 FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?))
-        ''', (brand, model, manufacturer))
-        exist = cursor.fetchone()[0]
-        conn.close()
-        return exist
-
-    # 是否存在某厂商
-    def manufacturer_exist(self, name):
-        conn, cursor = connect_to_database()
-        cursor.execute('''
-            SELECT EXISTS(SELECT 1 FROM manufacturers WHERE name=?)
-        ''', (name,))
-        exist = cursor.fetchone()[0]
-        conn.close()
-        return exist
-    
-    # 是否存在某客户
-    def customer_exist(self, name):
-        conn, cursor = connect_to_database()
-        cursor.execute('''
-            SELECT EXISTS(SELECT 1 FROM customers WHERE name=?)
-        ''', (name,))
-        exist = cursor.fetchone()[0]
-        conn.close()
-        return exist
-    
-    # 创建客户
-    def add_customer(self, conn, cursor, customer_name):
-        cursor.execute('''
-            INSERT INTO customers (name) VALUES (?)
-        ''', (customer_name,))
-        conn.commit()
+                inventory.append(f'<td>{j}</td>')
+            inventory.append('</tr>')
+        return ''.join(inventory).encode('utf-8')
 
     # 整理数据并写入数据库
     def add_data(self, brand, model, manufacturer, operation, quantity, customer_name):
-        conn, cursor = connect_to_database()
         try:
-            # 买还是卖？
-            if operation == 'sell':
-                # 检查厂商是否存在
-                if not self.manufacturer_exist(manufacturer):
-                    self.send_msg_error(400, '厂商不存在', "", False)
-                    print('无法卖出：厂商不存在')
-                    return
-
-                # 检查车辆是否存在
-                if not self.vehicle_exist(brand, model, manufacturer):
-                    self.send_msg_error(400, '车辆不存在', "", False)
-                    print('无法卖出：车辆不存在')
-                    return
-                
-                # 检查库存是否足够
-                cursor.execute('''
-                    SELECT quantity FROM inventory
-                    WHERE vehicle_id = (SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?))
-                ''', (brand, model, manufacturer))
-                stock = cursor.fetchone()
-                if stock is None:
-                    self.send_msg_error(400, '车辆不存在', "", False)
-                    print('无法卖出：车辆不存在')
-                    return
-                if stock[0] < quantity:
-                    self.send_msg_error(400, '库存不足', "", False)
-                    print('无法卖出：库存不足')
-                    return
-                
-                # 检查客户是否存在
-                if not self.customer_exist(customer_name):
-                    # 创建客户
-                    self.add_customer(conn, cursor, customer_name)
-                
-                # 更新库存
-                cursor.execute('''
-                    UPDATE inventory SET quantity = quantity - ?
-                    WHERE vehicle_id = (SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?))
-                ''', (quantity, brand, model, manufacturer))
-
-                # 添加财务信息
-                cursor.execute('''
-                    INSERT INTO financials (vehicle_id, customer_id, transaction_type, amount, date) 
-                    VALUES (
-                        (SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?)),
-                        (SELECT id FROM customers WHERE name=?),
-                        '卖出',
-                        ?,
-                        date('now')
-                    )
-                ''', (brand, model, manufacturer, customer_name, quantity))
-
-            elif operation == 'buy':
-                # 检查厂商是否存在
-                if not self.manufacturer_exist(manufacturer):
-                    # 创建厂商
-                    cursor.execute('''
-                        INSERT INTO manufacturers (name) VALUES (?)
-                    ''', (manufacturer,))
-
-                # 检查车辆是否存在
-                if not self.vehicle_exist(brand, model, manufacturer):
-                    # 创建车辆
-                    cursor.execute('''
-                        INSERT INTO vehicles (brand, model, manufacturer_id) 
-                        VALUES (?, ?, (SELECT id FROM manufacturers WHERE name=?))
-                    ''', (brand, model, manufacturer))
-
-                    # 更新库存
-                    cursor.execute('''
-                        INSERT INTO inventory (vehicle_id, quantity)
-                        VALUES ((SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?)), ?)
-                    ''', (brand, model, manufacturer, quantity))
-                else:
-                    # 更新库存
-                    cursor.execute('''
-                        UPDATE inventory SET quantity = quantity + ?
-                        WHERE vehicle_id = (SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?))
-                    ''', (quantity, brand, model, manufacturer))
-                
-                # 检查客户是否存在
-                if not self.customer_exist(customer_name):
-                    # 创建客户
-                    self.add_customer(conn, cursor, customer_name)
-
-                # 添加财务信息
-                cursor.execute('''
-                    INSERT INTO financials (vehicle_id, customer_id, transaction_type, amount, date) 
-                    VALUES ((SELECT id FROM vehicles WHERE brand=? AND model=? AND manufacturer_id=(SELECT id FROM manufacturers WHERE name=?)), (SELECT id FROM customers WHERE name=?), '买入', ?, date('now'))
-                ''', (brand, model, manufacturer, customer_name, quantity))
-            else:
-                self.send_msg_error(400, '无效的操作', "", False)
-                return
-            conn.commit()
+            write_queue.submit(write_record, brand, model, manufacturer, operation, quantity, customer_name)
+        except WriteError as e:
+            self.send_msg_error(e.code, e.message, "", False)
+            return
         except Exception as e:
-            conn.rollback()  # 回滚事务
             self.send_msg_error(500, f'数据库操作失败: {str(e)}', "", False)
             print(f'数据库操作失败: {str(e)}')
-            conn.close()
             return
-        finally:
-            conn.close()
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write('success'.encode('utf-8'))
+        self.send_body(200, 'text/html; charset=utf-8', 'success'.encode('utf-8'))
     
+    # 批量写入买入与卖出记录：先校验全部记录，再在同一事务中写入，逐条返回结果
+    def add_batch(self, data):
+        if isinstance(data, list):
+            data = {'records': data}
+        records = data.get('records') if isinstance(data, dict) else None
+        if not isinstance(records, list) or not records:
+            self.send_json(400, {'success': False, 'error': '请提供记录列表'})
+            return
+        if len(records) > MAX_BATCH_RECORDS:
+            self.send_json(400, {'success': False, 'error': f'每批最多 {MAX_BATCH_RECORDS} 条记录'})
+            return
+        atomic = bool(data.get('atomic', False))
+        parsed = [parse_record(record) for record in records]
+        errors = [{'index': index, 'status': 'error', 'code': 400, 'message': error} for index, (_, error) in enumerate(parsed) if error]
+        if errors:
+            self.send_json(400, {'success': False, 'results': errors})
+            return
+        try:
+            results = write_queue.submit(write_records, [record for record, _ in parsed], atomic)
+        except BatchError as e:
+            self.send_json(400, {'success': False, 'results': e.results})
+            return
+        self.send_json(200, {'success': all(result['status'] == 'success' for result in results), 'results': results})
+
     # 生成并返回错误页面头信息和页面内容
     def send_msg_error(self, errorCode, errorMsg = '', buttons = "<a href='/login.html'>重新登录</a>", html = True):
-        self.send_response(errorCode)
         if html:
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.send_header('Cache-Control', 'public, max-age=5')
-            self.end_headers()
-            self.wfile.write(self.generate_error_html(errorCode, str(errorMsg).encode('utf-8'), buttons))
+            self.send_body(errorCode, 'text/html; charset=utf-8', self.generate_error_html(errorCode, str(errorMsg), buttons), {'Cache-Control': 'public, max-age=5'})
         else:
-            self.wfile.write(str(errorMsg).encode('utf-8'))
+            self.send_body(errorCode, 'text/plain; charset=utf-8', str(errorMsg).encode('utf-8'))
+
+    # 请求携带的会话令牌
+    def session_token(self):
+        cookie = http.cookies.SimpleCookie()
+        try:
+            cookie.load(self.headers.get('Cookie', ''))
+        except http.cookies.CookieError:
+            return None
+        return cookie['session'].value if 'session' in cookie else None
+
+    # 从会话表中获取当前操作员的角色，不查询数据库。
+    # 旧式链接中带有用户名和密码时，验证后签发会话并重定向到去掉凭据的地址。
+    # 未登录时发送错误响应（html 为假时发送 401 JSON）并返回 None
+    def authenticate(self, html=True):
+        session = session_store.get(self.session_token())
+        if session is not None:
+            return session.role
+        url = urlparse(self.path)
+        query_params = parse_qs(url.query)
+        if html and 'username' in query_params:
+            username = query_params.get('username', [''])[0]
+            password = query_params.get('password', [''])[0]
+            role = self.check_login(username, password)
+            if role:
+                token = session_store.create(username, role, operator_fingerprint(username, password, role))
+                query = urlencode({key: value for key, value in query_params.items() if key not in ('username', 'password')}, doseq=True)
+                self.send_response(303)
+                self.send_header('Location', url.path + ('?' + query if query else ''))
+                self.send_header('Set-Cookie', session_cookie(token))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+        if html:
+            self.send_body(200, 'text/html; charset=utf-8', self.generate_error_html(300, '用户名或密码有误。'))
+        else:
+            self.send_json(401, {'error': '请先登录'})
+        return None
 
     # 检查登录
     def check_login(self, username, password):
         conn, cursor = connect_to_database()
         # 从数据库中获取用户名和密码相对应的用户信息
-        cursor.execute("SELECT role FROM operators WHERE username=? AND password=?", (username, password))
+        with metrics.time_query('check_login'):
+            cursor.execute("SELECT role FROM operators WHERE username=? AND password=?", (username, password))
         role = cursor.fetchone()
         # 格式化 role
         role = role[0] if role else None
@@ -1008,29 +2981,303 @@ class car_sales_system(http.server.BaseHTTPRequestHandler):
             return False
         return True
 
+# 客户端是否接受某种内容编码
+def accepts_encoding(accept_encoding, encoding):
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() not in (encoding, '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+# 静态资源：保存编码后的内容、gzip 压缩版本、强 ETag 与修改时间
+class StaticAsset:
+    def __init__(self, content, content_type, modified_time):
+        self.content = content
+        self.content_type = content_type
+        self.etag = f'"{hashlib.sha1(content).hexdigest()[:20]}"'
+        # 压缩后更小时才保留 gzip 版本，不同编码的表示使用不同的 ETag
+        gzip_content = gzip.compress(content, 9, mtime=0)
+        self.gzip_content = gzip_content if len(gzip_content) < len(content) else None
+        self.gzip_etag = self.etag[:-1] + '-gzip"'
+        self.modified_time = int(modified_time)
+        self.last_modified = email.utils.formatdate(self.modified_time, usegmt=True)
+
+    # 条件请求是否命中：优先比较 If-None-Match（只与本次协商选定的表示的 ETag 比较），其次比较 If-Modified-Since
+    def not_modified(self, headers, etag):
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+        if_modified_since = headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return email.utils.parsedate_to_datetime(if_modified_since).timestamp() >= self.modified_time
+            except (TypeError, ValueError):
+                return False
+        return False
+
+# 由页面生成函数动态生成、不能作为静态资源的页面
+DYNAMIC_PAGES = {'inventory_management.html', 'vehicles_management.html'}
+
+# 构建静态资源表：路径 -> StaticAsset。static_dir 中的文件会覆盖同名的内置资源
+def build_static_assets(static_dir=None):
+    started = time.time()
+    html_type = 'text/html; charset=utf-8'
+    index = StaticAsset(car_sales_system.generate_index_html(), html_type, started)
+    assets = {
+        '/': index,
+        '/index.html': index,
+        '/login.html': StaticAsset(car_sales_system.generate_login_html(), html_type, started),
+        '/test_page.html': StaticAsset(car_sales_system.generate_test_page_html(), html_type, started),
+        '/car_sales_system.css': StaticAsset(car_sales_system.generate_css(), 'text/css', started),
+        '/favicon.ico': StaticAsset(car_sales_system.generate_favicon(), 'image/svg+xml', started),
+    }
+    if static_dir:
+        for name in sorted(os.listdir(static_dir)):
+            path = os.path.join(static_dir, name)
+            if name in DYNAMIC_PAGES or not os.path.isfile(path):
+                continue
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if content_type.startswith('text/'):
+                content_type += '; charset=utf-8'
+            with open(path, 'rb') as file:
+                assets['/' + name] = StaticAsset(file.read(), content_type, os.path.getmtime(path))
+        if '/index.html' in assets:
+            assets['/'] = assets['/index.html']
+    return assets
+
+STATIC_ASSETS = build_static_assets()
+
 # 初始化网页服务器
 def initialize_server():
     parser = argparse.ArgumentParser(description='汽车销售系统')
+    parser.add_argument('--database', default=DATABASE, help='数据库文件路径')
     parser.add_argument('--port', type=int, default=2666, help='监听的端口')
+    parser.add_argument('--mode', choices=['single', 'threaded', 'pool'], default='pool', help='请求处理模式：single 单线程，threaded 每个请求一个线程，pool 有界线程池')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='前端：threads 使用 socketserver 与 HTTP/1.0，asyncio 使用事件循环与 HTTP/1.1 持久连接')
+    parser.add_argument('--keep-alive-timeout', type=float, default=60, help='asyncio 前端中空闲持久连接的超时时间，单位为秒')
+    parser.add_argument('--processes', type=int, default=1, help='工作进程数，大于 1 时预先创建多个进程共享监听端口')
+    parser.add_argument('--workers', type=int, default=8, help='线程池模式与 asyncio 前端的工作线程数')
+    parser.add_argument('--backlog', type=int, default=64, help='监听队列长度')
+    parser.add_argument('--pool-size', type=int, default=0, help='数据库连接池上限，默认为工作线程数加一（写线程）')
+    parser.add_argument('--commit-window', type=float, default=2, help='组提交窗口，单位为毫秒')
+    parser.add_argument('--static-dir', help='额外加载的静态文件目录，例如 web')
+    parser.add_argument('--gzip-min-size', type=int, default=1024, help='动态响应启用 gzip 压缩的最小长度，单位为字节')
+    parser.add_argument('--gzip-level', type=int, default=6, choices=range(1, 10), metavar='1-9', help='动态响应的 gzip 压缩级别')
+    parser.add_argument('--fragment-cache-mb', type=float, default=32, help='页面片段与接口正文缓存的容量上限，单位为 MB，0 表示不缓存')
+    parser.add_argument('--console-max-rows', type=int, default=1000, help='控制台单条指令最多返回的行数')
+    parser.add_argument('--console-timeout', type=float, default=5.0, help='控制台单条指令的执行时间上限，单位为秒')
+    parser.add_argument('--trace-sql', action='store_true', help='跟踪每条 SQL 语句，记录慢查询与超出语句预算的请求')
+    parser.add_argument('--slow-query-ms', type=float, default=100, help='慢查询阈值，单位为毫秒')
+    parser.add_argument('--statement-budget', type=int, default=50, help='单个请求的语句数预算')
+    parser.add_argument('--repeat-budget', type=int, default=10, help='单个请求中同一形状语句的重复次数预算')
+    parser.add_argument('--trace-log', help='SQL 跟踪日志文件，默认输出到标准错误')
+    parser.add_argument('--session-ttl', type=int, default=28800, help='登录会话的有效期，单位为秒')
+    parser.add_argument('--max-sessions', type=int, default=10000, help='同时保存的登录会话上限')
+    subparsers = parser.add_subparsers(dest='command', metavar='命令', help='不指定命令时启动网页服务器')
+    # 批量导入
+    import_parser = subparsers.add_parser('import', help='从 CSV 或 NDJSON 文件批量导入交易记录与库存盘点')
+    import_parser.add_argument('file', help='导入的文件，- 表示标准输入')
+    import_parser.add_argument('--format', choices=['csv', 'ndjson'], help='文件格式，默认按扩展名判断')
+    import_parser.add_argument('--chunk-size', type=int, default=5000, help='每个事务写入的行数')
+    import_parser.add_argument('--progress', type=int, default=100000, help='每导入多少行报告一次进度')
+    # 生成测试数据
+    seed_parser = subparsers.add_parser('seed', help='在新数据库中生成可复现的大规模测试数据')
+    seed_parser.add_argument('--manufacturers', type=int, default=20, help='厂商数')
+    seed_parser.add_argument('--models', type=int, default=400, help='车辆型号数，平均分配给各厂商')
+    seed_parser.add_argument('--customers', type=int, default=50000, help='客户数')
+    seed_parser.add_argument('--transactions', type=int, default=1000000, help='交易数（不含开业时的买入）')
+    seed_parser.add_argument('--start', default='2022-01-01', help='起始日期，YYYY-MM-DD')
+    seed_parser.add_argument('--end', default='2024-12-31', help='截止日期，YYYY-MM-DD')
+    seed_parser.add_argument('--skew', type=float, default=1.0, help='车辆热度的齐普夫指数，越大销量越集中')
+    seed_parser.add_argument('--sell-ratio', type=float, default=0.8, help='交易中卖出的比例')
+    seed_parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    seed_parser.add_argument('--force', action='store_true', help='覆盖已存在的数据库')
+    # 导出财务信息
+    export_parser = subparsers.add_parser('export', help='把财务信息导出为 CSV 或 NDJSON')
+    export_parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv', help='导出格式')
+    export_parser.add_argument('--output', default='-', help='输出文件，- 表示标准输出')
+    for key, help_text in (('start', '起始日期（含），YYYY-MM-DD'), ('end', '截止日期（含），YYYY-MM-DD'), ('brand', '车辆品牌'), ('model', '车辆型号'), ('customer', '客户名称')):
+        export_parser.add_argument(f'--{key}', default='', help=help_text)
     args = parser.parse_args()
 
-    server_address = ('0.0.0.0', args.port)
-    httpd = socketserver.TCPServer(server_address, car_sales_system)
-    httpd.allow_reuse_address = True
-
+    if args.trace_sql:
+        sql_tracer.enabled = True
+        sql_tracer.slow_query_ms = args.slow_query_ms
+        sql_tracer.statement_budget = args.statement_budget
+        sql_tracer.repeat_budget = args.repeat_budget
+        if args.trace_log:
+            sql_tracer.log = open(args.trace_log, 'a', encoding='utf-8')
+    use_database(args.database)
+    if args.command == 'seed':
+        if os.path.exists(DATABASE) and not args.force:
+            print(f'数据库 {DATABASE} 已存在，使用 --force 覆盖')
+            sys.exit(1)
+        seed_database(args.manufacturers, args.models, args.customers, args.transactions, args.start, args.end, args.skew, args.sell_ratio, args.seed)
+        return
+    # 检查数据库是否存在
+    prepare_database()
+
+    if args.command == 'export':
+        export_file(args.output, args.format, {key: getattr(args, key) for key in EXPORT_FILTERS})
+        return
+    if args.command == 'import':
+        file_format = args.format or ('ndjson' if args.file.endswith(('.ndjson', '.jsonl')) else 'csv')
+        import_file(args.file, file_format, args.chunk_size, args.progress)
+        return
+
+    car_sales_system.gzip_min_size = args.gzip_min_size
+    car_sales_system.gzip_level = args.gzip_level
+    fragment_cache.max_bytes = int(args.fragment_cache_mb * 1024 * 1024)
+    car_sales_system.console_max_rows = args.console_max_rows
+    car_sales_system.console_timeout = args.console_timeout
+
+    if args.static_dir:
+        STATIC_ASSETS.update(build_static_assets(args.static_dir))
+
+    write_queue.window = args.commit_window / 1000
+
+    database_pool.size = args.pool_size or max(args.workers, 1) + 1
+    identity_cache.warm()
+    session_store.ttl = args.session_ttl
+    session_store.max_sessions = args.max_sessions
+
+    httpd = create_server(('0.0.0.0', args.port), car_sales_system, args.mode, args.workers, args.backlog, args.engine, args.keep_alive_timeout)
     print(f'服务器地址：http://127.0.0.1:{args.port}')
-    httpd.serve_forever()
+    if args.processes > 1:
+        serve_prefork(httpd, args.processes)
+        return
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+# 多进程模式：父进程监听端口后创建 processes 个工作进程，工作进程继承监听套接字并各自接受连接、
+# 各自打开数据库连接（WAL 模式下多个进程可同时读，写事务由 SQLite 的锁串行化）。
+# 父进程只负责监督：工作进程意外退出时重新创建，收到 SIGTERM 或 SIGINT 时通知工作进程处理完当前请求后退出
+def serve_prefork(httpd, processes):
+    if not hasattr(os, 'fork'):
+        print('当前系统不支持多进程模式')
+        sys.exit(1)
+    # 关闭父进程中的数据库连接，工作进程不继承任何打开的连接
+    database_pool.invalidate()
+    data_version.reset()
+    # 各进程的前缀索引不会收到其他进程新增的名称，定期重新加载
+    prefix_index.max_age = 30
+    # 各工作进程写入指标快照的目录
+    metrics_directory = tempfile.mkdtemp(prefix='car_sales_metrics_')
+    # 进程号 -> (序号, 启动时间)
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def spawn(worker):
+        pid = os.fork()
+        if pid == 0:
+            run_worker_process(httpd, metrics_directory, worker)
+        children[pid] = (worker, time.monotonic())
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in range(processes):
+        spawn(worker)
+    try:
+        while children:
+            pid, status = os.wait()
+            child = children.pop(pid, None)
+            if child is None or stopping:
+                continue
+            worker, started = child
+            print(f'工作进程 {pid} 意外退出（状态 {status}），正在重新创建')
+            # 启动后很快退出时稍等再创建，避免反复崩溃时占满 CPU
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            spawn(worker)
+    finally:
+        httpd.server_close()
+        shutil.rmtree(metrics_directory, ignore_errors=True)
+    print('服务器已停止')
+
+# 工作进程：重置从父进程继承的状态后处理请求，收到 SIGTERM 时停止接受新连接并退出
+def run_worker_process(httpd, metrics_directory, worker):
+    code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        write_queue.queue = queue.Queue()
+        write_queue.thread = None
+        data_version.reset()
+        metrics.start_publishing(metrics_directory, worker)
+        httpd.serve_forever()
+        httpd.server_close()
+    except BaseException as e:
+        print(f'工作进程 {os.getpid()} 出错：{e}')
+        code = 1
+    finally:
+        os._exit(code)
+
+# 按前端与运行模式创建服务器
+def create_server(server_address, handler, mode='pool', workers=8, backlog=64, engine='threads', keep_alive_timeout=60):
+    if engine == 'asyncio':
+        return AsyncioServer(server_address, handler, workers, backlog, keep_alive_timeout)
+    if mode == 'pool':
+        return PoolingServer(server_address, handler, workers, backlog)
+    if mode == 'threaded':
+        return ThreadingServer(server_address, handler, backlog)
+    httpd = socketserver.TCPServer(server_address, handler, bind_and_activate=False)
+    httpd.allow_reuse_address = True
+    httpd.request_queue_size = backlog
+    httpd.server_bind()
+    httpd.server_activate()
+    return httpd
+
+# 切换数据库文件，废弃现有连接与缓存
+def use_database(path):
+    global DATABASE
+    DATABASE = path
+    database_pool.database = path
+    database_pool.invalidate()
+    invalidate_caches()
+
+# 数据库不存在时创建并写入初始数据，否则升级到最新结构
+def prepare_database():
+    if not os.path.exists(DATABASE):
+        print("数据库不存在，正在创建...")
+        initialize_database()
+        initialize_data()
+    else:
+        migrate_database()
 
 # 重建数据库
 def reset_database():
-    if os.path.exists('car_sales.db'):
-        os.remove('car_sales.db')
+    database_pool.invalidate()
+    # 同时删除会话文件以及 WAL 日志与共享内存文件
+    for path in database_files(DATABASE):
+        if os.path.exists(path):
+            os.remove(path)
     initialize_database()
     initialize_data()
+    # 通知其他工作进程重新连接
+    database_epoch.bump()
     return '数据库重建成功'
 
-# 初始化数据库结构
-def initialize_database():
+# 初始化数据库结构，migrate 为假时只建表，索引等结构变更留待写入数据后再执行
+def initialize_database(migrate=True):
     # 连接到 SQLite 数据库（如果数据库不存在，则会自动创建）
     conn, cursor = connect_to_database()
 
@@ -1102,6 +3349,137 @@ def initialize_database():
     # 关闭连接
     conn.close()
 
+    # 添加索引等后续结构变更
+    if migrate:
+        migrate_database()
+
+# 数据库结构迁移：(版本号, SQL 语句列表)，按版本号顺序执行，当前版本记录在 PRAGMA user_version 中
+MIGRATIONS = [
+    # 1：合并重复的厂商、车辆、客户与库存记录，添加唯一索引
+    (1, [
+        # 厂商名称唯一
+        '''UPDATE vehicles SET manufacturer_id = (
+               SELECT MIN(m2.id) FROM manufacturers m1, manufacturers m2 WHERE m1.id = vehicles.manufacturer_id AND m2.name = m1.name)
+           WHERE manufacturer_id NOT IN (SELECT MIN(id) FROM manufacturers GROUP BY name)''',
+        'DELETE FROM manufacturers WHERE id NOT IN (SELECT MIN(id) FROM manufacturers GROUP BY name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS manufacturers_name ON manufacturers (name)',
+        # 同一厂商的品牌与型号唯一
+        '''UPDATE financials SET vehicle_id = (
+               SELECT MIN(v2.id) FROM vehicles v1, vehicles v2
+               WHERE v1.id = financials.vehicle_id AND v2.brand = v1.brand AND v2.model = v1.model AND v2.manufacturer_id IS v1.manufacturer_id)
+           WHERE vehicle_id NOT IN (SELECT MIN(id) FROM vehicles GROUP BY brand, model, manufacturer_id)''',
+        '''UPDATE inventory SET vehicle_id = (
+               SELECT MIN(v2.id) FROM vehicles v1, vehicles v2
+               WHERE v1.id = inventory.vehicle_id AND v2.brand = v1.brand AND v2.model = v1.model AND v2.manufacturer_id IS v1.manufacturer_id)
+           WHERE vehicle_id NOT IN (SELECT MIN(id) FROM vehicles GROUP BY brand, model, manufacturer_id)''',
+        'DELETE FROM vehicles WHERE id NOT IN (SELECT MIN(id) FROM vehicles GROUP BY brand, model, manufacturer_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS vehicles_identity ON vehicles (brand, model, manufacturer_id)',
+        # 客户名称唯一
+        '''UPDATE financials SET customer_id = (
+               SELECT MIN(c2.id) FROM customers c1, customers c2 WHERE c1.id = financials.customer_id AND c2.name = c1.name)
+           WHERE customer_id NOT IN (SELECT MIN(id) FROM customers GROUP BY name)''',
+        'DELETE FROM customers WHERE id NOT IN (SELECT MIN(id) FROM customers GROUP BY name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS customers_name ON customers (name)',
+        # 每种车辆只有一条库存记录，重复的库存数量合并到最早的记录中
+        '''UPDATE inventory SET quantity = (SELECT SUM(i2.quantity) FROM inventory i2 WHERE i2.vehicle_id = inventory.vehicle_id)
+           WHERE id IN (SELECT MIN(id) FROM inventory GROUP BY vehicle_id HAVING COUNT(*) > 1)''',
+        'DELETE FROM inventory WHERE id NOT IN (SELECT MIN(id) FROM inventory GROUP BY vehicle_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS inventory_vehicle ON inventory (vehicle_id)',
+    ]),
+    # 2：按车辆、交易类型与日期查询财务信息
+    (2, [
+        'CREATE INDEX IF NOT EXISTS financials_vehicle_type_date ON financials (vehicle_id, transaction_type, date)',
+    ]),
+    # 3：销售日记录与销售月记录，随每笔卖出增量维护
+    (3, [
+        '''CREATE TABLE IF NOT EXISTS sales_daily (
+               vehicle_id INTEGER NOT NULL,
+               day TEXT NOT NULL,
+               amount INTEGER NOT NULL,
+               PRIMARY KEY (vehicle_id, day)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS sales_monthly (
+               vehicle_id INTEGER NOT NULL,
+               month TEXT NOT NULL,
+               amount INTEGER NOT NULL,
+               PRIMARY KEY (vehicle_id, month)
+           ) WITHOUT ROWID''',
+    ] + REBUILD_SALES_ROLLUPS),
+    # 4：按日期倒序分页浏览交易信息，以及按客户筛选
+    (4, [
+        'CREATE INDEX IF NOT EXISTS financials_date ON financials (date)',
+        'CREATE INDEX IF NOT EXISTS financials_customer_date ON financials (customer_id, date)',
+    ]),
+    # 5：登录会话，供多个工作进程共享
+    (5, [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+               token TEXT PRIMARY KEY,
+               username TEXT NOT NULL,
+               role TEXT NOT NULL,
+               fingerprint TEXT NOT NULL,
+               expires REAL NOT NULL
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)',
+    ]),
+    # 6：在版本 2 的索引中加入数量，进销存统计只扫描索引而不回表
+    (6, [
+        'CREATE INDEX IF NOT EXISTS financials_movements ON financials (vehicle_id, transaction_type, date, amount)',
+        'DROP INDEX IF EXISTS financials_vehicle_type_date',
+    ]),
+    # 7：历史版本。写入、修改或删除今天以前的财务信息时由触发器递增（包括其他进程与 import 命令的写入），
+    # 已结束日期范围的进销存统计以此判断是否需要重新统计
+    (7, [
+        'CREATE TABLE IF NOT EXISTS history_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO history_version (id, version) VALUES (1, 0)',
+        '''CREATE TRIGGER IF NOT EXISTS financials_history_insert AFTER INSERT ON financials
+           WHEN NEW.date < date('now')
+           BEGIN UPDATE history_version SET version = version + 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS financials_history_update AFTER UPDATE ON financials
+           WHEN OLD.date < date('now') OR NEW.date < date('now')
+           BEGIN UPDATE history_version SET version = version + 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS financials_history_delete AFTER DELETE ON financials
+           WHEN OLD.date < date('now')
+           BEGIN UPDATE history_version SET version = version + 1; END''',
+    ]),
+    # 8：登录会话移到单独的会话文件，会话的写入不再改变主数据库的数据版本
+    (8, [
+        'INSERT OR IGNORE INTO auth.sessions SELECT token, username, role, fingerprint, expires FROM main.sessions',
+        'DROP TABLE IF EXISTS main.sessions',
+    ]),
+    # 9：删除版本 7 的触发器。触发器对每一行都要更新一次历史版本，导入大量历史数据时明显变慢；
+    # 改为由写入今天以前财务信息的 import 命令与控制台在每个事务中递增一次
+    (9, [
+        'DROP TRIGGER IF EXISTS financials_history_insert',
+        'DROP TRIGGER IF EXISTS financials_history_update',
+        'DROP TRIGGER IF EXISTS financials_history_delete',
+    ]),
+]
+
+# 把数据库结构升级到最新版本
+def migrate_database():
+    conn, cursor = connect_to_database()
+    try:
+        for version, statements in MIGRATIONS:
+            # 在写事务中重新读取版本号，避免多个进程重复迁移
+            cursor.execute('BEGIN IMMEDIATE')
+            if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            print(f'数据库结构已升级至版本 {version}')
+    finally:
+        conn.close()
+
+# 初始操作员：(用户名, 密码, 角色)
+DEFAULT_OPERATORS = [
+    ('202235010623', '202235010623', 'admin'),
+    ('202235010611', '202235010611', 'admin'),
+    ('guest', 'guest', 'guest'),
+]
+
 # 初始化数据库内容
 def initialize_data():
     # 连接到 SQLite 数据库
@@ -1118,9 +3496,7 @@ def initialize_data():
     cursor.execute("INSERT INTO vehicles (brand, model, manufacturer_id) VALUES ('奔驰', 'C-Class', 3)")
 
     # 插入操作员信息
-    cursor.execute("INSERT INTO operators (username, password, role) VALUES ('202235010623', '202235010623', 'admin')")
-    cursor.execute("INSERT INTO operators (username, password, role) VALUES ('202235010611', '202235010611', 'admin')")
-    cursor.execute("INSERT INTO operators (username, password, role) VALUES ('guest', 'guest', 'guest')")
+    cursor.executemany('INSERT INTO operators (username, password, role) VALUES (?, ?, ?)', DEFAULT_OPERATORS)
 
     # 插入财务信息
     cursor.execute("INSERT INTO financials (vehicle_id, transaction_type, amount, customer_id, date) VALUES (3, '卖出', 1, 1, '2023-01-01')")
@@ -1136,15 +3512,254 @@ def initialize_data():
     cursor.execute("INSERT INTO inventory (vehicle_id, quantity) VALUES (3, 1)")
     cursor.execute("INSERT INTO inventory (vehicle_id, quantity) VALUES (1, 1)")
 
+    # 生成销售日记录与销售月记录
+    for statement in REBUILD_SALES_ROLLUPS:
+        cursor.execute(statement)
+
     # 提交事务
     conn.commit()
     # 关闭连接
     conn.close()
 
+# 生成测试数据使用的品牌名称，超出时按序号命名
+SEED_BRANDS = ['宝马', '奔驰', '奥迪', '丰田', '本田', '大众', '福特', '日产', '现代', '起亚', '比亚迪', '吉利', '长城', '长安', '奇瑞', '红旗', '蔚来', '理想', '小鹏', '特斯拉']
+SEED_SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+SEED_GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂'
+
+# 在新建的数据库中生成测试数据：厂商、车辆、客户与按时间顺序排列的交易。
+# 车辆的热度服从指数为 skew 的齐普夫分布，每日交易量随时间增长且周末更多；每种车辆在起始日期先买入一批，
+# 库存不足时卖出改为补货，因此库存始终等于买入减去卖出。相同的参数总是生成相同的数据。
+# 数据按批写入没有索引的表，最后统一建立索引并生成销售汇总
+def seed_database(manufacturers=20, models=400, customers=50000, transactions=1000000, start='2022-01-01', end='2024-12-31',
+                  skew=1.0, sell_ratio=0.8, seed=1, batch_size=50000):
+    began = time.perf_counter()
+    rng = random.Random(seed)
+    first_day = datetime.date.fromisoformat(start)
+    days = (datetime.date.fromisoformat(end) - first_day).days + 1
+    if days < 1:
+        raise ValueError('截止日期早于起始日期')
+    manufacturers = max(1, manufacturers)
+    models = max(1, models)
+    customers = max(1, customers)
+
+    # 重新建立只有表、没有索引的数据库
+    database_pool.invalidate()
+    for path in database_files(DATABASE):
+        if os.path.exists(path):
+            os.remove(path)
+    initialize_database(migrate=False)
+
+    conn, cursor = connect_to_database()
+    try:
+        cursor.execute('PRAGMA synchronous = OFF')
+        cursor.executemany('INSERT INTO operators (username, password, role) VALUES (?, ?, ?)', DEFAULT_OPERATORS)
+        brands = [SEED_BRANDS[i] if i < len(SEED_BRANDS) else f'品牌{i + 1}' for i in range(manufacturers)]
+        cursor.executemany('INSERT INTO manufacturers (id, name) VALUES (?, ?)', ((i + 1, f'{brand}汽车') for i, brand in enumerate(brands)))
+        cursor.executemany('INSERT INTO vehicles (id, brand, model, manufacturer_id) VALUES (?, ?, ?, ?)',
+                           ((i + 1, brands[i % manufacturers], f'{"ABCDEFGHJKLMNPQRSTUVWXYZ"[i // manufacturers % 24]}{i // manufacturers // 24 + 1}', i % manufacturers + 1) for i in range(models)))
+        cursor.executemany('INSERT INTO customers (id, name) VALUES (?, ?)',
+                           ((i + 1, f'{SEED_SURNAMES[i % len(SEED_SURNAMES)]}{SEED_GIVEN_NAMES[i // len(SEED_SURNAMES) % len(SEED_GIVEN_NAMES)]}{i // (len(SEED_SURNAMES) * len(SEED_GIVEN_NAMES)) + 1:04d}') for i in range(customers)))
+
+        # 车辆热度与每日交易量的累积权重
+        vehicle_ids = list(range(1, models + 1))
+        rng.shuffle(vehicle_ids)
+        vehicle_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(models)))
+        day_weights = [(1 + day / days) * (1.5 if (first_day + datetime.timedelta(days=day)).weekday() >= 5 else 1) for day in range(days)]
+        total_weight = sum(day_weights)
+
+        # 开业时每种车辆买入一批
+        stock = [0] * (models + 1)
+        rows = []
+        for vehicle_id in range(1, models + 1):
+            stock[vehicle_id] = rng.randint(5, 20)
+            rows.append((vehicle_id, '买入', stock[vehicle_id], rng.randint(1, customers), start))
+        written = 0
+        remainder = 0.0
+        for day in range(days):
+            date = (first_day + datetime.timedelta(days=day)).isoformat()
+            # 按权重分配当日交易数，余数累积到下一天
+            remainder += transactions * day_weights[day] / total_weight
+            count = min(int(remainder), transactions - written) if day < days - 1 else transactions - written
+            remainder -= count
+            for vehicle_id in rng.choices(vehicle_ids, cum_weights=vehicle_weights, k=count):
+                quantity = 1 if rng.random() < 0.8 else 2 + int(rng.random() * 2)
+                if rng.random() < sell_ratio and stock[vehicle_id] >= quantity:
+                    stock[vehicle_id] -= quantity
+                    rows.append((vehicle_id, '卖出', quantity, int(rng.random() * customers) + 1, date))
+                else:
+                    quantity = 2 + int(rng.random() * 7)
+                    stock[vehicle_id] += quantity
+                    rows.append((vehicle_id, '买入', quantity, int(rng.random() * customers) + 1, date))
+            written += count
+            if len(rows) >= batch_size:
+                cursor.executemany('INSERT INTO financials (vehicle_id, transaction_type, amount, customer_id, date) VALUES (?, ?, ?, ?, ?)', rows)
+                conn.commit()
+                rows = []
+        cursor.executemany('INSERT INTO financials (vehicle_id, transaction_type, amount, customer_id, date) VALUES (?, ?, ?, ?, ?)', rows)
+        cursor.executemany('INSERT INTO inventory (vehicle_id, quantity) VALUES (?, ?)', ((vehicle_id, stock[vehicle_id]) for vehicle_id in range(1, models + 1)))
+        conn.commit()
+        cursor.execute('PRAGMA synchronous = FULL')
+    finally:
+        conn.close()
+
+    # 建立索引并生成销售汇总
+    migrate_database()
+    conn, cursor = connect_to_database()
+    try:
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+    invalidate_caches()
+    print(f'已生成 {manufacturers} 个厂商、{models} 种车辆、{customers} 个客户与 {models + transactions} 笔交易，用时 {time.perf_counter() - began:.1f} 秒')
+
+# 导入文件中的操作取值：买入、卖出与库存盘点
+IMPORT_OPERATIONS = {'buy': '买入', 'sell': '卖出', '买入': '买入', '卖出': '卖出', 'count': '盘点', '盘点': '盘点', 'adjust': '盘点调整', '盘点调整': '盘点调整'}
+
+# 逐行读取导入文件，返回 (行号, 记录) 的迭代器：CSV 为字典，NDJSON 为未解析的一行（由 parse_import_row 逐行解析，格式有误的行只跳过该行）
+def read_import_rows(file, file_format):
+    if file_format == 'csv':
+        for line_number, row in enumerate(csv.DictReader(file), 2):
+            yield line_number, row
+    else:
+        for line_number, line in enumerate(file, 1):
+            if line.strip():
+                yield line_number, line
+
+# 解析并校验一行导入记录，返回 (操作, 数量, 品牌, 型号, 厂商, 客户名称, 日期)，格式有误时抛出 ValueError
+def parse_import_row(row, today):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError:
+            raise ValueError('JSON 格式有误')
+    if not isinstance(row, dict):
+        raise ValueError('不是 JSON 对象')
+    operation = IMPORT_OPERATIONS.get(str(row.get('operation') or '').strip())
+    if operation is None:
+        raise ValueError('无效的操作')
+    try:
+        quantity = int(row.get('quantity'))
+    except (TypeError, ValueError):
+        raise ValueError('数量有误')
+    brand, model, manufacturer = (str(row.get(key) or '').strip() for key in ('brand', 'model', 'manufacturer'))
+    customer_name = str(row.get('customername') or row.get('customer') or '').strip()
+    # 日期统一保存为 YYYY-MM-DD，分页游标、销售记录与进销存统计都依赖这一格式
+    try:
+        date = datetime.date.fromisoformat(str(row.get('date') or today).strip()).isoformat()
+    except ValueError:
+        raise ValueError('日期格式应为 YYYY-MM-DD')
+    if not brand or not model or not manufacturer or (operation in ('买入', '卖出') and not customer_name):
+        raise ValueError('字段不完整')
+    if quantity < 0 and operation != '盘点调整':
+        raise ValueError('数量不能为负')
+    return operation, quantity, brand, model, manufacturer, customer_name, date
+
+# 批量导入：厂商、车辆与客户通过内存中的名称 -> 编号映射解析或创建，交易记录按块用 executemany 写入，
+# 每块在一个事务中同时更新库存与销售日记录、销售月记录，内存占用与文件大小无关
+def import_file(path, file_format, chunk_size=5000, progress=100000):
+    conn, cursor = connect_to_database()
+    manufacturers = dict(cursor.execute('SELECT name, id FROM manufacturers'))
+    vehicles = {(brand, model, manufacturer_id): vehicle_id for vehicle_id, brand, model, manufacturer_id in cursor.execute('SELECT id, brand, model, manufacturer_id FROM vehicles')}
+    customers = dict(cursor.execute('SELECT name, id FROM customers'))
+    today = time.strftime('%Y-%m-%d', time.gmtime())
+    started = time.monotonic()
+    imported = skipped = 0
+    chunk = []
+    # 车辆编号 -> [盘点数量或 None, 数量变化]
+    stock = {}
+
+    # 解析名称对应的编号，不存在时创建
+    def resolve(mapping, key, sql, params):
+        row_id = mapping.get(key)
+        if row_id is None:
+            cursor.execute(sql, params)
+            row_id = mapping[key] = cursor.lastrowid
+        return row_id
+
+    # 写入当前块，块中有今天以前的记录时在同一事务中递增一次历史版本
+    def flush():
+        if any(date < today for _, _, _, _, date in chunk):
+            bump_history_version(conn)
+        cursor.executemany('INSERT INTO financials (vehicle_id, transaction_type, amount, customer_id, date) VALUES (?, ?, ?, ?, ?)', chunk)
+        cursor.executemany('''
+            INSERT INTO inventory (vehicle_id, quantity) VALUES (?, ?)
+            ON CONFLICT (vehicle_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', [(vehicle_id, delta) for vehicle_id, (counted, delta) in stock.items() if counted is None])
+        cursor.executemany('''
+            INSERT INTO inventory (vehicle_id, quantity) VALUES (?, ?)
+            ON CONFLICT (vehicle_id) DO UPDATE SET quantity = excluded.quantity
+        ''', [(vehicle_id, counted + delta) for vehicle_id, (counted, delta) in stock.items() if counted is not None])
+        sales = {}
+        for vehicle_id, transaction_type, amount, customer_id, date in chunk:
+            if transaction_type == '卖出':
+                sales[vehicle_id, date] = sales.get((vehicle_id, date), 0) + amount
+        cursor.executemany('''
+            INSERT INTO sales_daily (vehicle_id, day, amount) VALUES (?, ?, ?)
+            ON CONFLICT (vehicle_id, day) DO UPDATE SET amount = amount + excluded.amount
+        ''', [(vehicle_id, day, amount) for (vehicle_id, day), amount in sales.items()])
+        cursor.executemany('''
+            INSERT INTO sales_monthly (vehicle_id, month, amount) VALUES (?, substr(?, 1, 7), ?)
+            ON CONFLICT (vehicle_id, month) DO UPDATE SET amount = amount + excluded.amount
+        ''', [(vehicle_id, day, amount) for (vehicle_id, day), amount in sales.items()])
+        conn.commit()
+        chunk.clear()
+        stock.clear()
+
+    file = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for line_number, row in read_import_rows(file, file_format):
+            try:
+                operation, quantity, brand, model, manufacturer, customer_name, date = parse_import_row(row, today)
+            except ValueError as e:
+                skipped += 1
+                if skipped <= 20:
+                    print(f'跳过第 {line_number} 行：{e}')
+                continue
+            manufacturer_id = resolve(manufacturers, manufacturer, 'INSERT INTO manufacturers (name) VALUES (?)', (manufacturer,))
+            vehicle_id = resolve(vehicles, (brand, model, manufacturer_id), 'INSERT INTO vehicles (brand, model, manufacturer_id) VALUES (?, ?, ?)', (brand, model, manufacturer_id))
+            if operation == '盘点':
+                # 盘点数量与账面库存的差额记为一笔盘点调整，财务信息与库存保持一致
+                counted, delta = stock.get(vehicle_id, (None, 0))
+                if counted is None:
+                    row = cursor.execute('SELECT quantity FROM inventory WHERE vehicle_id = ?', (vehicle_id,)).fetchone()
+                    counted = row[0] if row else 0
+                adjustment = quantity - (counted + delta)
+                if adjustment:
+                    chunk.append((vehicle_id, '盘点调整', adjustment, None, date))
+                stock[vehicle_id] = [quantity, 0]
+            else:
+                customer_id = resolve(customers, customer_name, 'INSERT INTO customers (name) VALUES (?)', (customer_name,)) if customer_name else None
+                chunk.append((vehicle_id, operation, quantity, customer_id, date))
+                stock.setdefault(vehicle_id, [None, 0])[1] += -quantity if operation == '卖出' else quantity
+            imported += 1
+            if imported % chunk_size == 0:
+                flush()
+                cursor.execute('BEGIN IMMEDIATE')
+            if imported % progress == 0:
+                print(f'已导入 {imported} 行，{imported / (time.monotonic() - started):.0f} 行/秒')
+        flush()
+    finally:
+        conn.close()
+        if file is not sys.stdin:
+            file.close()
+    elapsed = time.monotonic() - started
+    print(f'导入完成：{imported} 行，跳过 {skipped} 行，用时 {elapsed:.1f} 秒，{imported / max(elapsed, 1e-9):.0f} 行/秒')
+    return imported, skipped
+
+# 把财务信息导出到文件或标准输出
+def export_file(path, file_format, filters):
+    conn, cursor = connect_to_database()
+    file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    try:
+        for data in encode_financials(query_financials(cursor, **filters), file_format):
+            file.write(data)
+    finally:
+        conn.close()
+        if path == '-':
+            file.flush()
+        else:
+            file.close()
+
 if __name__ == '__main__':
-    # 检查 car_sales.db 数据库是否存在
-    if not os.path.exists('car_sales.db'):
-        print("数据库不存在，正在创建...")
-        initialize_database()
-        initialize_data()
     initialize_server()